@@ -0,0 +1,177 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 5
+FOLDER = "benchmark"
+LAYERS = ["2018.tif", "2019.tif", "2020.tif"]
+# Each command with the message it ends with when it succeeds (commands
+# exit with their message, so the exit code is not enough) and the maximum
+# best wall time, in seconds. validate reads the layers and validates the
+# collection, so it has to import rasterio, GDAL, pystac and jsonschema.
+COMMANDS = [
+    (["-h"], "usage:", 1.0),
+    (
+        ["inject", "-f", FOLDER, "--no-backup"],
+        "Items injected and collection.json overwritten successfully.",
+        1.0,
+    ),
+    (
+        ["validate", "-f", FOLDER, "--no-cache"],
+        "Validation successful.",
+        5.0,
+    ),
+]
+HEAVY_MODULES = [
+    "azure",
+    "httpx",
+    "jsonschema",
+    "osgeo",
+    "pystac",
+    "rasterio",
+    "requests",
+    "shapely",
+]
+MAIN = os.path.abspath(os.path.join(os.path.dirname(__file__), "main.py"))
+SPEC_DIR = os.path.abspath(os.path.join(os.path.dirname(MAIN), "..", "spec"))
+
+
+def create_fixture(work_dir):
+    """
+    Create input/FOLDER in work_dir with a few small layers and a
+    collection.json without items, which inject fills in.
+    """
+    import numpy as np
+    import rasterio
+    from rasterio.transform import from_origin
+
+    os.symlink(SPEC_DIR, os.path.join(work_dir, "spec"))
+    input_dir = os.path.join(work_dir, "input", FOLDER)
+    os.makedirs(input_dir)
+
+    for value, layer in enumerate(LAYERS):
+        with rasterio.open(
+            os.path.join(input_dir, layer),
+            "w",
+            driver="GTiff",
+            width=256,
+            height=256,
+            count=1,
+            dtype="uint8",
+            crs="EPSG:4326",
+            transform=from_origin(-74.0, 5.0, 0.001, 0.001),
+        ) as dst:
+            dst.write(np.full((1, 256, 256), value % 2, dtype="uint8"))
+
+    with open(os.path.join(input_dir, "collection.json"), "w") as f:
+        json.dump(
+            {
+                "id": "Benchmark",
+                "title": "Benchmark",
+                "description": "Layers of the startup benchmark",
+                "metadata": {
+                    "data_type": "Clasificada",
+                    "projection": {"epsg": 4326},
+                    "properties": {
+                        "values": [0, 1],
+                        "colors": ["#000000", "#ffffff"],
+                        "classes": ["No", "Yes"],
+                    },
+                },
+                "items": [],
+            },
+            f,
+        )
+
+
+def command_env(work_dir):
+    """
+    Environment of the benchmarked commands, with authentication disabled:
+    the STAC server is unreachable and there is no cached token, so a
+    command that tries to authenticate fails.
+    """
+    env = dict(os.environ)
+    env.update(
+        STAC_URL="http://127.0.0.1:9",
+        TOKEN="",
+        TOKEN_CACHE_PATH=os.path.join(work_dir, "token.json"),
+    )
+    return env
+
+
+def time_command(args, success, work_dir, env):
+    """
+    Best wall time, in seconds, of RUNS runs of main.py with args. Raise
+    RuntimeError with the output of a run that does not print success.
+    """
+    best = float("inf")
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, MAIN, *args],
+            cwd=work_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        best = min(best, time.perf_counter() - start)
+        if success not in result.stdout + result.stderr:
+            raise RuntimeError(result.stderr.strip() or result.stdout.strip())
+    return best
+
+
+def heavy_imports(work_dir):
+    """Heavy modules imported just by importing main.py."""
+    code = (
+        f"import sys; sys.path.insert(0, {os.path.dirname(MAIN)!r}); "
+        "import main; "
+        "print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=work_dir,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    loaded = set(result.stdout.split())
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def run_benchmark():
+    ok = True
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        imported = heavy_imports(work_dir)
+        if imported:
+            print(f"❌ main.py importa al iniciar: {', '.join(imported)}")
+            ok = False
+        else:
+            print("✅ main.py no importa dependencias pesadas al iniciar.")
+
+        create_fixture(work_dir)
+        env = command_env(work_dir)
+
+        for args, success, max_seconds in COMMANDS:
+            label = " ".join(["main.py", *args])
+            try:
+                seconds = time_command(args, success, work_dir, env)
+            except RuntimeError as e:
+                print(f"❌ {label}: falló\n{e}")
+                ok = False
+                continue
+            if seconds > max_seconds:
+                print(f"❌ {label}: {seconds:.3f} s (máximo {max_seconds} s)")
+                ok = False
+            else:
+                print(f"✅ {label}: {seconds:.3f} s")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_benchmark()
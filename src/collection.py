@@ -1,22 +1,47 @@
 import json
 import os
-import re
-from copy import deepcopy
+from collections import Counter
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from datetime import datetime, timedelta
 from os import makedirs, path, remove, rmdir
+from queue import Queue
 from sys import exit as sysexit
+from threading import Lock, Thread
 from urllib import parse
 
 import pystac
-import rasterio
-from pystac import Asset, Item
 from pystac.extensions.projection import ProjectionExtension
-from pystac.extensions.raster import RasterBand, RasterExtension
+from pystac.extensions.raster import (
+    Histogram,
+    RasterBand,
+    RasterExtension,
+    Statistics,
+)
 
 from config import get_settings
-from utils import raster, stac_rest, storage
-from utils.logging_config import logger
-from utils.stac_helpers import map_dtype_to_pystac_datatype
+from utils import raster, stac_rest, stac_validation
+from utils.checksum import file_digest
+from utils.cog_profiles import AUTO_PROFILE, select_cog_profile
+from utils.logging_config import (
+    LazyJson,
+    get_process_queue,
+    init_worker_logging,
+    log_context,
+    logger,
+)
+from utils.metrics import measure, metrics
+from utils.stac_helpers import (
+    map_dtype_to_pystac_datatype,
+    supports_bulk_items,
+)
+
+SOURCE_CHECKSUM_PROPERTY = "source_checksum"
 
 
 class Collection:
@@ -30,28 +55,71 @@ class Collection:
         self.stac_collection: pystac.Collection
         self.stac_items = []
         self.stac_url = get_settings().stac_url
-        self.storage = storage.Storage()
+        self._storage = None
+        self.register_concurrency = None
+        self.journal = None
+        self.reused_urls = {}
+        self.stale_urls = {}
+        self.changed_ids = set()
+        self.stats_mode = None
+        self.footprint_mode = "bbox"
+
+    @property
+    def storage(self):
+        """
+        Blob storage client, created on first use so that commands that do
+        not touch the storage never import or configure the Azure SDK.
+        """
+        if self._storage is None:
+            from utils.storage import Storage
+
+            self._storage = Storage()
+        return self._storage
 
-    def load_items(self, folder, raw_items):
+    @storage.setter
+    def storage(self, value):
+        self._storage = value
+
+    def load_items(self, folder, raw_items, cache=None, checksums=False):
         """
         Prepare items data and get attributes for collection creation.
         Respect an existing 'proj:epsg' in properties; compute it only if missing.
         Fail fast if EPSG cannot be resolved (required by downstream tools).
+        File headers are read concurrently (METADATA_WORKERS threads), or
+        taken from the metadata cache if given and the file is unchanged.
+        Footprints follow footprint_mode ('bbox' or 'data').
+        With checksums, the MD5 of each input file is stored in the
+        'source_checksum' property, so later syncs can detect changed layers.
         """
         logger.info(f"Loading items from {folder}")
 
-        for item in raw_items:
-            item_data = {}
-            file_path = f"{folder}/{item['assets']['input_file']}"
-            logger.info(f"Retrieving metadata from file: {file_path}")
+        file_paths = [
+            f"{folder}/{item['assets']['input_file']}" for item in raw_items
+        ]
+        metadatas = raster.scan_metadata(
+            file_paths,
+            get_settings().metadata_workers,
+            cache,
+            self.footprint_mode,
+        )
+        source_checksums = (
+            self.source_checksums(file_paths, cache)
+            if checksums
+            else [None] * len(file_paths)
+        )
+        if cache:
+            cache.save()
 
-            (
-                item_data["bbox"],
-                item_data["footprint"],
-                item_data["crs"],
-                item_data["resolution"],
-                item_data["dtype"],
-            ) = raster.get_tif_metadata(file_path)
+        for item, file_path, metadata, checksum in zip(
+            raw_items, file_paths, metadatas, source_checksums
+        ):
+            item_data = {}
+            item_data["bbox"] = metadata.bbox
+            item_data["native_bbox"] = metadata.native_bbox
+            item_data["footprint"] = metadata.footprint
+            item_data["crs"] = metadata.crs
+            item_data["resolution"] = metadata.resolution
+            item_data["dtype"] = metadata.dtype
 
             item_data["year"] = item["year"]
             item_data["id"] = item["id"]
@@ -70,37 +138,21 @@ class Collection:
                 logger.info(
                     f"Keeping existing proj:epsg={epsg} for item {item_data['id']}"
                 )
-            else:
-
-                try:
-                    with rasterio.open(file_path) as src:
-                        epsg = src.crs.to_epsg() if src.crs else None
-                except Exception as e:
-                    logger.info(
-                        f"Could not get EPSG via rasterio for {file_path}: {e}"
-                    )
-
-                if epsg is None:
-                    crs_code = item_data["crs"]
-                    if isinstance(crs_code, dict) and "init" in crs_code:
-                        try:
-                            epsg = int(str(crs_code["init"]).split(":")[1])
-                        except Exception:
-                            epsg = None
-                    elif isinstance(crs_code, int):
-                        epsg = crs_code
-
-                if epsg is not None:
-                    logger.info(
-                        f"Computed proj:epsg={epsg} for item {item_data['id']}"
-                    )
-                    item_data["properties"]["proj:epsg"] = int(epsg)
+            elif metadata.epsg is not None:
+                epsg = metadata.epsg
+                logger.info(
+                    f"Computed proj:epsg={epsg} for item {item_data['id']}"
+                )
+                item_data["properties"]["proj:epsg"] = epsg
 
             if epsg is None:
                 raise ValueError(
                     f"Missing proj:epsg for item {item_data['id']} (file: {file_path}, CRS: {item_data['crs']})"
                 )
 
+            if checksum:
+                item_data["properties"][SOURCE_CHECKSUM_PROPERTY] = checksum
+
             self.items.append(item_data)
             self.dates.append(item["year"])
             self.longs.extend([item_data["bbox"][0], item_data["bbox"][2]])
@@ -108,6 +160,22 @@ class Collection:
 
         logger.info("Items loaded successfully")
 
+    def source_checksums(self, file_paths, cache=None):
+        """
+        Compute the MD5 of the input files in a pool of METADATA_WORKERS
+        threads, reusing the ones kept in the metadata cache.
+        """
+        if cache:
+            checksum = cache.checksum
+        else:
+
+            def checksum(file_path):
+                return file_digest(file_path).hexdigest()
+
+        workers = max(get_settings().metadata_workers, 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(checksum, file_paths))
+
     def create_collection(self, collection_name, collection_data):
         """
         Set the parameters and create an initial collection.
@@ -173,7 +241,7 @@ class Collection:
         except Exception as e:
             logger.warning(f"Could not build resolution summaries: {e}")
 
-        self.stac_collection.validate()
+        stac_validation.validate_collection(self.stac_collection)
         logger.info(f"Collection {collection_id} validated successfully")
 
         return collection_id
@@ -197,13 +265,18 @@ class Collection:
                 ProjectionExtension.ext(item).epsg = item_data["properties"][
                     "proj:epsg"
                 ]
+                if "native_bbox" in item_data:
+                    ProjectionExtension.ext(item).bbox = item_data[
+                        "native_bbox"
+                    ]
                 item.stac_extensions = [
-                    "https://stac-extensions.github.io/projection/v1.0.0/schema.json",
-                    "https://stac-extensions.github.io/raster/v1.1.0/schema.json",
+                    stac_validation.PROJECTION_SCHEMA,
+                    stac_validation.RASTER_SCHEMA,
                 ]
-                item.validate()
                 self.stac_items.append(item)
 
+            stac_validation.validate_items(self.stac_items)
+
     def check_collection(self, overwritten):
         """
         Check if the collection exists and if it's going to be overwritten.
@@ -225,7 +298,8 @@ class Collection:
     def get_collection_from_server(self, collection_id):
         """
         Get collection and its items from STAC server.
-        Returns collection metadata and items list.
+        Returns collection metadata and an iterator over its items, which
+        fetches them page by page as it is consumed.
         """
         collection_url = f"{self.stac_url}/collections/{collection_id}"
         logger.info(f"Fetching collection {collection_id} from server")
@@ -233,25 +307,16 @@ class Collection:
         collection_response = stac_rest.get(collection_url)
         collection_data = collection_response.json()
 
-        items_url = f"{collection_url}/items"
-        items_response = stac_rest.get(items_url)
-        items_data = items_response.json().get("features", [])
-
-        logger.info(f"Collection found with {len(items_data)} items")
+        logger.info(f"Collection {collection_id} found")
 
-        return collection_data, items_data
+        return collection_data, stac_rest.iter_items(f"{collection_url}/items")
 
-    def validate_item_against_collection(
-        self, new_item_data, collection_metadata, existing_items
-    ):
+    def describe_collection_specs(self, collection_metadata, existing_items):
         """
-        Validate that a new item matches the collection's specifications:
-        - Projection (EPSG)
-        - Spatial resolution
-        - Data type (classified/continuous)
+        Get the projection (EPSG), spatial resolution and data type of a
+        collection from its metadata and existing items, so several new
+        items can be validated against them without reading the items again.
         """
-        logger.info("Validating new item against collection specifications")
-
         # Get projection from collection metadata or existing items
         collection_projection = None
         if (
@@ -262,35 +327,46 @@ class Collection:
                 "projection"
             ].get("epsg")
 
-        if collection_projection is None and existing_items:
-            # Extract from first existing item
-            first_item = existing_items[0]
-            collection_projection = first_item.get("properties", {}).get(
-                "proj:epsg"
-            )
-
-        # Get spatial resolution from existing items
+        # Get projection (from the first existing item, if the collection
+        # metadata has none) and spatial resolution from existing items,
+        # reading only as many items as needed
         collection_resolution = None
-        if existing_items:
-            for item in existing_items:
-                if "raster:bands" in item.get("assets", {}).get(
-                    list(item["assets"].keys())[0], {}
-                ):
-                    band_info = item["assets"][list(item["assets"].keys())[0]][
-                        "raster:bands"
-                    ][0]
-                    if "spatial_resolution" in band_info:
-                        collection_resolution = band_info["spatial_resolution"]
-                        break
-
-        # Get and validate data type from collection metadata
-        collection_data_type = None
-        if (
-            "metadata" in collection_metadata
-            and "data_type" in collection_metadata.get("metadata", {})
-        ):
-            collection_data_type = collection_metadata["metadata"]["data_type"]
-            
+        for index, item in enumerate(existing_items):
+            if collection_projection is None and index == 0:
+                collection_projection = item.get("properties", {}).get(
+                    "proj:epsg"
+                )
+
+            assets = list(item.get("assets", {}).values())
+            if assets and "raster:bands" in assets[0]:
+                band_info = assets[0]["raster:bands"][0]
+                if "spatial_resolution" in band_info:
+                    collection_resolution = band_info["spatial_resolution"]
+                    break
+
+        return {
+            "projection": collection_projection,
+            "resolution": collection_resolution,
+            "data_type": collection_metadata.get("metadata", {}).get(
+                "data_type"
+            ),
+        }
+
+    def validate_item_against_specs(self, new_item_data, specs):
+        """
+        Validate a new item against the collection specifications returned
+        by describe_collection_specs.
+        """
+        logger.info(
+            f"Validating item {new_item_data.get('id')} against collection "
+            "specifications"
+        )
+        collection_projection = specs["projection"]
+        collection_resolution = specs["resolution"]
+
+        # Validate data type against collection metadata
+        collection_data_type = specs["data_type"]
+        if collection_data_type is not None:
             # Validate that item dtype is compatible with collection data_type
             item_dtype = new_item_data.get("dtype", "").lower()
             is_integer_type = item_dtype in ("uint8", "ubyte", "uint16", "uint32", "int16", "int32")
@@ -346,14 +422,23 @@ class Collection:
         logger.info(f"Attempting to remove collection {collection_id}")
 
         try:
-            items_response = stac_rest.get(f"{collection_url}/items")
-            items = items_response.json().get("features", [])
-
-            for item in items:
-                for asset_key, asset_value in item["assets"].items():
-                    url = asset_value["href"]
-                    logger.info(f"Deleting file {url} from Azure Blob Storage")
-                    self.storage.remove_file(url)
+            urls = [
+                asset_value["href"]
+                for item in stac_rest.iter_items(f"{collection_url}/items")
+                for asset_value in item["assets"].values()
+            ]
+            logger.info(
+                f"Deleting {len(urls)} asset files and any other file under "
+                f"{collection_id}/ from Azure Blob Storage"
+            )
+            summary = self.storage.remove_files(
+                urls, prefix=f"{collection_id}/"
+            )
+            if summary["failed"]:
+                raise RuntimeError(
+                    f"Could not delete {len(summary['failed'])} files: "
+                    f"{', '.join(summary['failed'])}"
+                )
 
             stac_rest.delete(collection_url)
             logger.info(f"Collection {collection_id} removed successfully")
@@ -362,203 +447,847 @@ class Collection:
             logger.error(f"Error removing collection from server: {e}")
             raise RuntimeError(f"Error removing collection from server: {e}")
 
-    def upload_single_item(self, item_data, asset_href=None):
+    def plan_sync(self):
         """
-        Upload a single item to an existing collection on the STAC server.
+        Compare the local items with the items of the collection on the
+        server, and keep in self.items only those that have to be published:
+        - new: missing on the server.
+        - changed: their source checksum differs, so the layer is converted
+          again (discarding any local COG of an earlier run) and uploaded.
+        - updated: only their properties, bbox or geometry differ, so they are
+          registered again with the asset already uploaded.
+        Unchanged items are dropped. Server items missing locally are kept in
+        self.stale_urls, with their asset files, for remove_stale_items.
+        Return the number of items in each state.
+        """
+        collection_url = (
+            f"{self.stac_url}/collections/{self.stac_collection.id}"
+        )
+        local = {item["id"]: i for i, item in enumerate(self.items)}
+        states = {}
+        self.stale_urls = {}
+
+        if stac_rest.check_resource(collection_url):
+            for remote_item in stac_rest.iter_items(f"{collection_url}/items"):
+                i = local.get(remote_item["id"])
+                if i is None:
+                    self.stale_urls[remote_item["id"]] = [
+                        asset["href"]
+                        for asset in remote_item.get("assets", {}).values()
+                    ]
+                else:
+                    states[i] = self._sync_state(i, remote_item)
+
+        counts = Counter(states.get(i, "new") for i in range(len(self.items)))
+        self.changed_ids = {
+            self.items[i]["id"]
+            for i, state in states.items()
+            if state == "changed"
+        }
+        counts["removed"] = len(self.stale_urls.keys() - local.keys())
+
+        pending = [
+            i
+            for i in range(len(self.items))
+            if states.get(i, "new") != "unchanged"
+        ]
+        self.items = [self.items[i] for i in pending]
+        self.stac_items = [self.stac_items[i] for i in pending]
+
+        logger.info(
+            "Sync plan: "
+            + ", ".join(
+                f"{counts[state]} {state}"
+                for state in ("new", "changed", "updated", "unchanged")
+            )
+            + f", {counts['removed']} removed"
+        )
+        return dict(counts)
 
-        Args:
-            item_data: Dictionary with item metadata
-            asset_href: URL for the asset (optional, will be constructed if not provided)
+    def _sync_state(self, index, remote_item):
         """
-        try:
-            logger.info(f"Uploading single item: {item_data['id']}")
-
-            # Create STAC item from item_data
-            item = Item(
-                id=item_data["id"],
-                geometry=item_data["footprint"],
-                bbox=item_data["bbox"],
-                datetime=item_data["datetime"],
-                properties=item_data["properties"],
+        Compare a local item with its version on the server (see plan_sync).
+        Asset files replaced by a new file name are added to self.stale_urls.
+        """
+        item = self.items[index]
+        local_item = json.loads(json.dumps(self.stac_items[index].to_dict()))
+        remote_properties = remote_item.get("properties", {})
+        remote_asset = remote_item.get("assets", {}).get(item["id"])
+
+        checksum = item["properties"].get(SOURCE_CHECKSUM_PROPERTY)
+        if (
+            remote_asset is None
+            or checksum is None
+            or remote_properties.get(SOURCE_CHECKSUM_PROPERTY) != checksum
+        ):
+            new_blob = f"{self.stac_collection.id}/{item['input_file']}"
+            old_urls = [
+                asset["href"]
+                for asset in remote_item.get("assets", {}).values()
+                if self.storage.blob_name(asset["href"]) != new_blob
+            ]
+            if old_urls:
+                self.stale_urls[item["id"]] = old_urls
+            return "changed"
+
+        same = (
+            local_item["bbox"] == remote_item.get("bbox")
+            and local_item["geometry"] == remote_item.get("geometry")
+            and all(
+                remote_properties.get(key) == value
+                for key, value in local_item["properties"].items()
             )
+        )
+        if same:
+            return "unchanged"
 
-            # Use provided asset_href or construct default one
-            if asset_href is None:
-                settings = get_settings()
-                asset_href = (
-                    f"{settings.asset_base_url}/{settings.abs_container}/"
-                    f"{self.stac_collection.id}/{item_data['input_file']}"
-                )
+        self.reused_urls[item["id"]] = remote_asset["href"]
+        return "updated"
 
-            logger.info(f"Using asset href: {asset_href}")
-
-            # Add assets
-            item.add_asset(
-                item_data["input_file"],
-                Asset(
-                    href=asset_href,
-                    media_type="image/tiff; application=geotiff; profile=cloud-optimized",
-                    roles=["data"],
-                    extra_fields={
-                        "raster:bands": [
-                            {
-                                "data_type": item_data["dtype"],
-                                "spatial_resolution": item_data["resolution"],
-                            }
-                        ]
-                    },
-                ),
+    def remove_stale_items(self):
+        """
+        Delete from the server the items found by plan_sync that no longer
+        exist locally, and then the asset files of those items and the files
+        replaced by changed items.
+        """
+        if not self.stale_urls:
+            return
+
+        items_url = (
+            f"{self.stac_url}/collections/{self.stac_collection.id}/items"
+        )
+        local_ids = {item["id"] for item in self.items}
+        for item_id in self.stale_urls:
+            if item_id not in local_ids:
+                stac_rest.delete(f"{items_url}/{item_id}")
+                logger.info(f"Removed item {item_id}")
+
+        urls = [url for urls in self.stale_urls.values() for url in urls]
+        summary = self.storage.remove_files(urls)
+        if summary["failed"]:
+            raise RuntimeError(
+                f"Could not delete {len(summary['failed'])} files: "
+                f"{', '.join(summary['failed'])}"
             )
+        self.stale_urls = {}
 
-            # Upload the item
-            item_dict = item.to_dict()
-            item_response = stac_rest.post_or_put(
+    def upload_collection(self):
+        """
+        Upload the collection and items to the STAC server.
+        """
+        pending = [
+            (item, stac_item)
+            for item, stac_item in zip(self.items, self.stac_items)
+            if not self._journal_get(item, "registered")
+        ]
+
+        try:
+            self.post_collection()
+            self.register_items(pending)
+
+        except Exception as e:
+            logger.error(f"Error uploading collection: {e}")
+
+            if self.journal is not None:
+                logger.info("Keeping uploaded files so the run can be resumed")
+                raise RuntimeError(f"Failed to upload collection: {e}")
+
+            for url in self.uploaded_urls:
+                try:
+                    self.storage.remove_file(url)
+                    logger.info(f"Removed uploaded file: {url}")
+                except Exception as cleanup_error:
+                    logger.error(
+                        f"Error cleaning up uploaded file {url}: {cleanup_error}"
+                    )
+
+            raise RuntimeError(f"Failed to upload collection: {e}")
+
+    def register_items(self, pending):
+        """
+        Register (item, stac_item) pairs in the collection on the server,
+        with the async engine, the bulk_items endpoint or one by one,
+        marking each item as registered in the journal.
+        """
+        if pending and (
+            self.register_concurrency or self.bulk_items_supported()
+        ):
+            pending_stac_items = [stac_item for _, stac_item in pending]
+            if self.register_concurrency:
+                self.post_items_async(pending_stac_items)
+            else:
+                self.post_items_bulk(pending_stac_items)
+            for item, _ in pending:
+                self._journal_mark(item, "registered")
+        else:
+            for item, stac_item in pending:
+                with log_context(item["id"]):
+                    item_response = self.post_item(stac_item)
+                    logger.info(
+                        f"Item upload response: {item_response.status_code}"
+                    )
+                    self._journal_mark(item, "registered")
+
+    def post_collection(self):
+        """
+        Post (or put, if it exists) the collection to the STAC server.
+        """
+        logger.info(f"Uploading collection: {self.stac_collection.id}")
+        logger.debug(
+            "Collection payload: %s", LazyJson(self.stac_collection.to_dict)
+        )
+
+        stac_rest.post_or_put(
+            parse.urljoin(self.stac_url, "/collections"),
+            self.stac_collection.to_dict(),
+        )
+        logger.info(
+            f"Collection {self.stac_collection.id} uploaded successfully"
+        )
+
+    def post_item(self, stac_item):
+        """
+        Post (or put, if it exists) a single item of the collection.
+        """
+        with metrics.span("registration", stac_item.id):
+            return stac_rest.post_or_put(
                 parse.urljoin(
                     self.stac_url,
                     f"/collections/{self.stac_collection.id}/items",
                 ),
-                item_dict,
+                stac_item.to_dict(),
             )
 
-            logger.info(
-                f"Item {item_data['id']} upload response: {item_response.status_code}"
-            )
+    def bulk_items_supported(self):
+        """
+        Decide whether items are registered through the bulk_items endpoint.
+        STAC_BULK_MODE is 'auto' (use it if the server conformance classes
+        advertise bulk transactions), 'on' or 'off'.
+        """
+        mode = get_settings().stac_bulk_mode.lower()
+        if mode in ("on", "off"):
+            return mode == "on"
 
-            if item_response.status_code in [200, 201]:
-                logger.info(f"Item {item_data['id']} uploaded successfully")
-                return True
-            else:
+        conformance = stac_rest.get_conformance(self.stac_url)
+        supported = supports_bulk_items(conformance)
+        logger.info(
+            "Bulk item ingestion "
+            f"{'supported' if supported else 'not supported'} by the server"
+        )
+        return supported
+
+    def post_items_bulk(self, stac_items, chunk_size=None):
+        """
+        Register items in chunks through the bulk_items endpoint (upsert).
+        A chunk the server rejects is retried item by item with post_item;
+        items that still fail are reported together at the end.
+        """
+        chunk_size = max(chunk_size or get_settings().stac_bulk_size, 1)
+        url = parse.urljoin(
+            self.stac_url,
+            f"/collections/{self.stac_collection.id}/bulk_items",
+        )
+        chunks = [
+            stac_items[start : start + chunk_size]
+            for start in range(0, len(stac_items), chunk_size)
+        ]
+        failures = {}
+
+        for number, chunk in enumerate(chunks, start=1):
+            label = (
+                f"Bulk chunk {number}/{len(chunks)} "
+                f"({chunk[0].id} .. {chunk[-1].id})"
+            )
+            try:
+                with metrics.span("registration"):
+                    response = stac_rest.post(
+                        url,
+                        {
+                            "items": {
+                                item.id: item.to_dict() for item in chunk
+                            },
+                            "method": "upsert",
+                        },
+                    )
+                logger.info(
+                    f"{label}: {len(chunk)} items registered, "
+                    f"response {response.status_code}"
+                )
+                continue
+            except Exception as e:
                 logger.error(
-                    f"Failed to upload item {item_data['id']}: {item_response.text}"
+                    f"{label} failed: {e}. Registering its items one by one"
                 )
-                return False
 
-        except Exception as e:
-            logger.error(f"Error uploading item {item_data['id']}: {e}")
-            return False
+            for item in chunk:
+                try:
+                    self.post_item(item)
+                except Exception as e:
+                    logger.error(f"Item {item.id} failed to register: {e}")
+                    failures[item.id] = e
 
-    def upload_collection(self):
+        if failures:
+            details = "; ".join(
+                f"{item_id}: {error}" for item_id, error in failures.items()
+            )
+            raise RuntimeError(
+                f"{len(failures)} of {len(stac_items)} items failed to "
+                f"register. {details}"
+            )
+
+    def post_items_async(self, stac_items):
         """
-        Upload the collection and items to the STAC server.
+        Register items concurrently with the async engine, keeping at most
+        register_concurrency requests in flight. Return the per-item results;
+        raise after logging every failed item.
         """
-        try:
-            logger.info(
-                f"Uploading collection: {self.stac_collection.to_dict()}"
+        from utils import stac_async
+
+        with metrics.span("registration"):
+            results = stac_async.register_items(
+                parse.urljoin(
+                    self.stac_url,
+                    f"/collections/{self.stac_collection.id}/items",
+                ),
+                [item.to_dict() for item in stac_items],
+                self.register_concurrency,
             )
 
-            stac_rest.post_or_put(
-                parse.urljoin(self.stac_url, "/collections"),
-                self.stac_collection.to_dict(),
+        failures = [result for result in results if not result.ok]
+        for result in failures:
+            logger.error(
+                f"Item {result.item_id} failed to register "
+                f"(status {result.status_code}): {result.error}"
             )
-            logger.info(
-                f"Collection {self.stac_collection.id} uploaded successfully"
+        if failures:
+            raise RuntimeError(
+                f"{len(failures)} of {len(results)} items failed to register: "
+                f"{', '.join(result.item_id for result in failures)}"
             )
+        return results
+
+    def publish_pipeline(
+        self,
+        input_dir,
+        output_dir,
+        workers=None,
+        queue_size=None,
+        delete_local_cog=False,
+    ):
+        """
+        Convert, upload and register the items as a stream instead of in
+        phases. The collection is posted first; then each item moves through
+        COG conversion, blob upload, item POST and (optionally) local COG
+        deletion as soon as the previous stage is done with it. Bounded queues
+        between the stages keep only a few COGs on disk at any time.
+        Failed items do not stop the others; all failures are reported at the
+        end.
+        """
+        if not path.exists(output_dir):
+            makedirs(output_dir)
+            logger.info(f"Directory created: {output_dir}")
 
-            for item in self.stac_items:
-                item_dict = item.to_dict()
-                item_response = stac_rest.post_or_put(
-                    parse.urljoin(
-                        self.stac_url,
-                        f"/collections/{self.stac_collection.id}/items",
-                    ),
-                    item_dict,
+        settings = get_settings()
+        workers = max(workers or settings.cog_workers, 1)
+        queue_size = max(queue_size or settings.pipeline_queue_size, 1)
+        upload_workers = max(settings.upload_workers, 1)
+        per_file = max(settings.upload_max_concurrency // upload_workers, 1)
+
+        self.uploaded_urls = []
+        self.post_collection()
+
+        upload_queue = Queue(maxsize=queue_size)
+        register_queue = Queue(maxsize=queue_size)
+        failures = {}
+        lock = Lock()
+        # Items the conversion stage is done with (queued for upload, failed
+        # or already registered), and the error that stopped it, if any.
+        handled = set()
+        conversion_error = []
+
+        def fail(i, stage, error):
+            name = self.items[i]["input_file"]
+            logger.error(f"{stage} failed for {name}: {error}")
+            with lock:
+                failures[name] = f"{stage}: {error}"
+
+        def collect(i, future):
+            handled.add(i)
+            try:
+                target_path = metrics.collect(future.result())
+            except Exception as e:
+                fail(i, "Conversion", e)
+                self._discard_conversion(self.items[i], output_dir)
+                return
+            self._conversion_done(self.items[i], target_path)
+            upload_queue.put(i)
+
+        def convert_stage():
+            try:
+                budget = self._conversion_budget(workers)
+                with self._process_pool(workers) as executor:
+                    in_flight = {}
+                    for i, item in enumerate(self.items):
+                        if self._journal_get(item, "registered"):
+                            logger.info(
+                                f"Item {item['id']} already registered, "
+                                "skipping"
+                            )
+                            handled.add(i)
+                            continue
+
+                        target_path = path.join(output_dir, item["input_file"])
+                        if not self._needs_conversion(item, target_path):
+                            handled.add(i)
+                            upload_queue.put(i)
+                            continue
+
+                        while len(in_flight) >= workers:
+                            done, _ = wait(
+                                in_flight, return_when=FIRST_COMPLETED
+                            )
+                            for future in done:
+                                collect(in_flight.pop(future), future)
+
+                        logger.info(f"Converting {item['input_file']} to COG")
+                        future = executor.submit(
+                            measure,
+                            "conversion",
+                            path.basename(item["input_file"]),
+                            *self._conversion_task(
+                                item, input_dir, output_dir, budget
+                            ),
+                        )
+                        in_flight[future] = i
+
+                    for future in as_completed(list(in_flight)):
+                        collect(in_flight.pop(future), future)
+            except Exception as e:
+                # An error outside collect (the pool, the checks of an item,
+                # submit) stops the stage: every item it did not get to fails
+                # and the error is raised once the other stages finish.
+                conversion_error.append(e)
+                for i in range(len(self.items)):
+                    if i not in handled:
+                        fail(i, "Conversion", e)
+            finally:
+                for _ in range(upload_workers):
+                    upload_queue.put(None)
+
+        def upload_stage():
+            while (i := upload_queue.get()) is not None:
+                with log_context(self.items[i]["id"]):
+                    upload_item(i)
+
+        def upload_item(i):
+            item = self.items[i]
+            try:
+                final_url = self._uploaded_url(item)
+                if not final_url:
+                    final_url = self.storage.upload_file(
+                        f"{self.stac_collection.id}/{item['input_file']}",
+                        path.join(output_dir, item["input_file"]),
+                        per_file,
+                    )
+                    self._journal_mark(item, "uploaded", final_url)
+                    with lock:
+                        self.uploaded_urls.append(final_url)
+                self.add_cog_asset(
+                    i, final_url, self._layer_statistics(item, output_dir)
                 )
+                self.validate_assets([self.stac_items[i]])
+            except Exception as e:
+                fail(i, "Upload", e)
+                return
+            logger.info(f"Uploaded {item['input_file']}")
+            register_queue.put(i)
+
+        converter = Thread(target=convert_stage)
+        uploaders = [
+            Thread(target=upload_stage) for _ in range(upload_workers)
+        ]
+        for thread in [converter, *uploaders]:
+            thread.start()
+
+        def close_register_queue():
+            for thread in uploaders:
+                thread.join()
+            register_queue.put(None)
+
+        Thread(target=close_register_queue).start()
+
+        while (i := register_queue.get()) is not None:
+            item = self.items[i]
+            try:
+                item_response = self.post_item(self.stac_items[i])
                 logger.info(
-                    f"Item upload response: {item_response.status_code}"
+                    f"Item {item['id']} upload response: "
+                    f"{item_response.status_code}"
                 )
+            except Exception as e:
+                fail(i, "Registration", e)
+                continue
+            self._journal_mark(item, "registered")
 
-        except Exception as e:
-            logger.error(f"Error uploading collection: {e}")
-
-            for url in self.uploaded_urls:
+            if delete_local_cog:
+                file_path = path.join(output_dir, item["input_file"])
                 try:
-                    self.storage.remove_file(url)
-                    logger.info(f"Removed uploaded file: {url}")
-                except Exception as cleanup_error:
-                    logger.error(
-                        f"Error cleaning up uploaded file {url}: {cleanup_error}"
-                    )
+                    if path.isfile(raster.statistics_path(file_path)):
+                        remove(raster.statistics_path(file_path))
+                    remove(file_path)
+                    logger.info(f"Removed local COG: {file_path}")
+                except Exception as e:
+                    logger.error(f"Error removing {file_path}: {e}")
 
-            raise RuntimeError(f"Failed to upload collection: {e}")
+        converter.join()
+
+        if conversion_error:
+            raise conversion_error[0]
 
-    def convert_layers(self, input_dir, output_dir):
+        if failures:
+            details = "; ".join(
+                f"{name}: {error}" for name, error in failures.items()
+            )
+            raise RuntimeError(
+                f"{len(failures)} of {len(self.items)} items failed to "
+                f"publish. {details}"
+            )
+
+    def _process_pool(self, workers):
+        """
+        Process pool whose workers send their log records to this process.
+        """
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker_logging,
+            initargs=(get_process_queue(),),
+        )
+
+    def _conversion_budget(self, workers):
+        """
+        Split the GDAL cache (GDAL_CACHEMAX_MB) and the conversion threads
+        (COG_NUM_THREADS, 0 for all CPUs) between the conversion workers.
+        Return the memory (MB) and threads for each of them.
+        """
+        settings = get_settings()
+        total_threads = settings.cog_num_threads or os.cpu_count() or 1
+        memory_mb = max(settings.gdal_cachemax_mb // workers, 64)
+        num_threads = max(total_threads // workers, 1)
+        logger.info(
+            f"Using {workers} conversion workers "
+            f"({memory_mb} MB GDAL cache and {num_threads} threads each)"
+        )
+        return memory_mb, num_threads
+
+    def convert_layers(self, input_dir, output_dir, workers=None):
         """
         Convert item layers to COG. If a target COG already exists in the output
         directory, skip its conversion. Ensure the output directory exists.
+        With more than one worker, layers are converted in a process pool and
+        the GDAL cache and threads are split between the workers. A failed
+        layer does not stop the others; all failures are reported at the end.
         """
         if not path.exists(output_dir):
             makedirs(output_dir)
             logger.info(f"Directory created: {output_dir}")
 
+        pending = {}
         for item in self.items:
-            src_name = item["input_file"]
-            target_path = path.join(output_dir, src_name)
+            target_path = path.join(output_dir, item["input_file"])
+            if self._needs_conversion(item, target_path):
+                pending[item["input_file"]] = item
 
-            if path.exists(target_path):
-                logger.info(
-                    f"COG already exists, skipping conversion: {target_path}"
+        if not pending:
+            return
+
+        workers = min(workers or get_settings().cog_workers, len(pending))
+        failures = {}
+
+        budget = self._conversion_budget(max(workers, 1))
+
+        def failed(src_name, error):
+            logger.error(f"Conversion failed for {src_name}: {error}")
+            failures[src_name] = error
+            self._discard_conversion(pending[src_name], output_dir)
+
+        if workers <= 1:
+            for src_name, item in pending.items():
+                logger.info(f"Converting {src_name} to COG")
+                func, *args = self._conversion_task(
+                    item, input_dir, output_dir, budget
                 )
-                continue
+                try:
+                    with metrics.span("conversion", path.basename(src_name)):
+                        target_path = func(*args)
+                except Exception as e:
+                    failed(src_name, e)
+                    continue
+                self._conversion_done(item, target_path)
+        else:
+            logger.info(f"Converting {len(pending)} layers in parallel")
+
+            with self._process_pool(workers) as executor:
+                futures = {
+                    executor.submit(
+                        measure,
+                        "conversion",
+                        path.basename(src_name),
+                        *self._conversion_task(
+                            item, input_dir, output_dir, budget
+                        ),
+                    ): src_name
+                    for src_name, item in pending.items()
+                }
+                for future in as_completed(futures):
+                    src_name = futures[future]
+                    try:
+                        target_path = metrics.collect(future.result())
+                    except Exception as e:
+                        failed(src_name, e)
+                        continue
+                    self._conversion_done(pending[src_name], target_path)
+
+        if failures:
+            details = "; ".join(
+                f"{name}: {error}" for name, error in failures.items()
+            )
+            raise RuntimeError(
+                f"{len(failures)} of {len(pending)} layers failed to "
+                f"convert to COG. {details}"
+            )
+
+    def _conversion_task(self, item, input_dir, output_dir, budget):
+        """
+        Function and arguments that convert an item layer to COG with the
+        memory and threads of budget (see _conversion_budget), its COG
+        profile and the statistics mode of the run.
+        """
+        memory_mb, num_threads = budget
+        return (
+            raster.tif_to_cog,
+            item["input_file"],
+            input_dir,
+            output_dir,
+            memory_mb,
+            num_threads,
+            self._cog_profile(item),
+            self.stats_mode,
+        )
+
+    def _conversion_done(self, item, target_path):
+        logger.info(f"Conversion completed: {target_path}")
+        self._journal_mark(item, "converted")
+
+    def _discard_conversion(self, item, output_dir):
+        """
+        Remove what a failed conversion of an item layer may have left: a
+        partial COG and its statistics sidecar.
+        """
+        target_path = path.join(output_dir, item["input_file"])
+        for file_path in (raster.statistics_path(target_path), target_path):
+            if path.isfile(file_path):
+                remove(file_path)
+
+    def _cog_profile(self, item):
+        """
+        Get the COG profile of an item: the 'cog_profile' of the collection
+        metadata or, if it is missing or 'auto', the one matching the
+        collection data type and the item dtype.
+        """
+        metadata = self.stac_collection.extra_fields.get("metadata", {})
+        profile = metadata.get("cog_profile", AUTO_PROFILE)
+        if profile == AUTO_PROFILE:
+            profile = select_cog_profile(
+                item.get("dtype"), metadata.get("data_type")
+            )
+        return profile
+
+    def _needs_conversion(self, item, target_path):
+        """
+        Decide whether an item layer has to be converted to COG. Layers
+        already uploaded in an interrupted run are skipped. When resuming, a
+        COG the journal does not mark as converted may be a partial file
+        from the interrupted conversion, so it is discarded and redone. The
+        COG of an item whose source changed since it was published (see
+        plan_sync) was made from the old source, so it is redone as well.
+        """
+        if self._uploaded_url(item):
+            logger.info(
+                f"{item['input_file']} already uploaded, skipping conversion"
+            )
+            return False
 
-            logger.info(f"Converting {src_name} to COG at {target_path}")
-            raster.tif_to_cog(src_name, input_dir, output_dir)
-            logger.info(f"Conversion completed: {target_path}")
+        if not path.exists(target_path):
+            return True
+
+        if self.journal and self.journal.resuming:
+            # The journal only marks COGs of the current sources.
+            reason = (
+                None if self._journal_get(item, "converted") else "unfinished"
+            )
+        else:
+            reason = "outdated" if item["id"] in self.changed_ids else None
+
+        if reason:
+            logger.info(f"Discarding {reason} COG: {target_path}")
+            if path.isfile(raster.statistics_path(target_path)):
+                remove(raster.statistics_path(target_path))
+            remove(target_path)
+            return True
+
+        logger.info(f"COG already exists, skipping conversion: {target_path}")
+        # A resumed run must not take it for a partial conversion.
+        self._journal_mark(item, "converted")
+        return False
+
+    def _uploaded_url(self, item):
+        """
+        Get the URL of an item layer already in storage: reused from the
+        server by a sync, or uploaded in an interrupted run.
+        """
+        return self.reused_urls.get(item["id"]) or self._journal_get(
+            item, "uploaded"
+        )
+
+    def _layer_statistics(self, item, output_dir):
+        """
+        Get the band statistics of an item COG if stats_mode is set, from its
+        sidecar file or, if the COG was converted without them, computing
+        them now. Return None if they are not wanted or the COG is gone.
+        """
+        if not self.stats_mode:
+            return None
+
+        file_path = path.join(output_dir, item["input_file"])
+        if not path.isfile(file_path):
+            logger.warning(
+                f"Local COG {file_path} not found, registering "
+                f"{item['id']} without statistics"
+            )
+            return None
+        return raster.cog_statistics(file_path, self.stats_mode)
+
+    def _journal_get(self, item, stage):
+        """
+        Get the recorded state of a stage for an item, if a journal is kept.
+        """
+        if self.journal is None:
+            return None
+        return self.journal.get(item["id"], stage)
+
+    def _journal_mark(self, item, stage, value=True):
+        """
+        Record that an item finished a stage, if a journal is kept.
+        """
+        if self.journal is not None:
+            self.journal.mark(item["id"], stage, value)
 
     def upload_layers(self, output_folder):
         """
         Upload item layers to storage and annotate raster:bands on each asset.
+        Files are uploaded concurrently; assets are attached afterwards in item
+        order so the result does not depend on which upload finishes first.
         """
         self.uploaded_urls = []
         if not self.items:
             return
 
+        urls = [self._uploaded_url(item) for item in self.items]
+        uploads = []
+        indexes = []
         for i, item in enumerate(self.items):
-            logger.info(f"Uploading {item['input_file']}")
+            if urls[i]:
+                logger.info(
+                    f"{item['input_file']} already uploaded, skipping upload"
+                )
+                continue
             file_path = path.join(output_folder, item["input_file"])
             if not path.isfile(file_path):
                 raise FileNotFoundError(f"Expected COG not found: {file_path}")
-
-            collection_name = self.stac_collection.id
-            final_url = self.storage.upload_file(
-                f"{collection_name}/{item['input_file']}", file_path
+            uploads.append(
+                (f"{self.stac_collection.id}/{item['input_file']}", file_path)
             )
+            indexes.append(i)
 
+        uploaded, failures = self.storage.upload_files(uploads)
+        for i, final_url in zip(indexes, uploaded):
             if final_url:
-                self.uploaded_urls.append(final_url)
+                urls[i] = final_url
+                self._journal_mark(self.items[i], "uploaded", final_url)
+        self.uploaded_urls = [url for url in uploaded if url]
 
-            asset = pystac.Asset(
-                href=final_url, media_type=pystac.MediaType.COG
+        if failures:
+            details = "; ".join(
+                f"{name}: {error}" for name, error in failures.items()
             )
-            self.stac_items[i].add_asset(
-                key=item["id"],
-                asset=asset,
+            raise RuntimeError(
+                f"{len(failures)} of {len(uploads)} layers failed to upload. "
+                f"{details}"
             )
 
-            try:
-                band_dtype = map_dtype_to_pystac_datatype(item.get("dtype"))
-                band_resolution = item.get("resolution")
+        for i, final_url in enumerate(urls):
+            self.add_cog_asset(
+                i,
+                final_url,
+                self._layer_statistics(self.items[i], output_folder),
+            )
+        self.validate_assets(self.stac_items)
 
-                bands = [
-                    RasterBand.create(
-                        data_type=band_dtype,
-                        spatial_resolution=band_resolution,
-                    )
-                ]
+    def add_cog_asset(self, index, final_url, statistics=None):
+        """
+        Attach the uploaded COG as an asset of the item at the given index,
+        annotating raster:bands, with the statistics and histogram of each
+        band if given (see raster.cog_statistics).
+        """
+        item = self.items[index]
+        stac_item = self.stac_items[index]
 
-                raster_ext = RasterExtension.ext(asset, add_if_missing=True)
-                raster_ext.bands = bands
+        asset = pystac.Asset(href=final_url, media_type=pystac.MediaType.COG)
+        stac_item.add_asset(
+            key=item["id"],
+            asset=asset,
+        )
 
-            except Exception as e:
-                logger.warning(
-                    f"Could not attach raster:bands to asset {item['id']}: {e}"
+        try:
+            band_dtype = map_dtype_to_pystac_datatype(item.get("dtype"))
+            band_resolution = item.get("resolution")
+
+            bands = [
+                RasterBand.create(
+                    data_type=band_dtype,
+                    spatial_resolution=band_resolution,
+                    statistics=Statistics.create(**band["statistics"]),
+                    histogram=(
+                        Histogram.create(**band["histogram"])
+                        if "histogram" in band
+                        else None
+                    ),
                 )
-
-            try:
-                self.stac_items[i].validate()
-            except Exception as e:
-                logger.warning(
-                    f"Item {self.stac_items[i].id} failed validation after assets: {e}"
+                for band in statistics or []
+            ] or [
+                RasterBand.create(
+                    data_type=band_dtype,
+                    spatial_resolution=band_resolution,
                 )
+            ]
+
+            raster_ext = RasterExtension.ext(asset, add_if_missing=True)
+            raster_ext.bands = bands
+
+        except Exception as e:
+            logger.warning(
+                f"Could not attach raster:bands to asset {item['id']}: {e}"
+            )
+
+    def validate_assets(self, stac_items):
+        """
+        Validate items after their assets were attached. Errors are logged as
+        a single warning, as the items were already validated when created.
+        """
+        try:
+            stac_validation.validate_items(stac_items)
+        except pystac.STACValidationError as e:
+            logger.warning(f"Validation failed after adding assets. {e}")
 
     def clean_local_cogs(
         self, output_folder: str, remove_dir_if_empty: bool = True
@@ -574,6 +1303,8 @@ class Collection:
         deleted = 0
         for item in self.items:
             file_path = path.join(output_folder, item["input_file"])
+            if path.isfile(raster.statistics_path(file_path)):
+                remove(raster.statistics_path(file_path))
             if path.isfile(file_path):
                 try:
                     remove(file_path)
@@ -591,122 +1322,3 @@ class Collection:
                 logger.info(f"Could not remove output directory: {e}")
 
         logger.info(f"Local cleanup completed. Files deleted: {deleted}")
-
-
-def update_collection_json_inplace(
-    input_folder: str,
-    output_path: str | None = None,
-    make_backup: bool = True,
-    backup_dir: str | None = None,
-):
-    """
-    Read input/<folder>/collection.json, scan .tif files in that folder,
-    create items from years/ranges in filenames:
-      - If a range like '2006-2010' or '2006_2010' is found, the item id is '2006-2010'
-        and 'year' will be the highest year ('2010').
-      - If only single years are found, id = that year and 'year' = that same year.
-    Overwrite collection.json injecting the generated 'items', or write to output_path.
-    If backup_dir is provided, write the backup there; otherwise next to target.
-    """
-    abs_input = path.abspath(input_folder)
-    if not path.isdir(input_folder):
-        raise ValueError(f"Input folder does not exist: {abs_input}")
-
-    template_path = path.join(input_folder, "collection.json")
-    abs_template = path.abspath(template_path)
-    if not path.isfile(template_path):
-        raise FileNotFoundError(
-            f"collection.json not found at: {abs_template}"
-        )
-
-    logger.info(f"Reading base collection from: {abs_template}")
-
-    with open(template_path, "r", encoding="utf-8") as f:
-        base = json.load(f)
-
-    tif_files = [
-        f for f in os.listdir(input_folder) if f.lower().endswith(".tif")
-    ]
-    if not tif_files:
-        raise ValueError(f"No .tif files found in {abs_input}")
-
-    logger.info(f"Found {len(tif_files)} .tif files in {abs_input}")
-
-    range_pattern = re.compile(r"(?P<start>\d{4})\s*[-_]\s*(?P<end>\d{4})")
-    year_pattern = re.compile(r"(\d{4})")
-
-    items = []
-    seen_ids = set()
-
-    for tif_file in sorted(tif_files):
-        rng = range_pattern.search(tif_file)
-        if rng:
-            start = int(rng.group("start"))
-            end = int(rng.group("end"))
-            if start > end:
-                start, end = end, start
-            item_id = f"{start}-{end}"
-            year = str(end)
-            logger.info(
-                f"Detected period in filename '{tif_file}': id={item_id}, year={year}"
-            )
-        else:
-            matches = year_pattern.findall(tif_file)
-            if not matches:
-                raise ValueError(
-                    f"ERROR: '{tif_file}' does not contain a 4-digit year or year range. "
-                    "Rename the file or adjust the detection pattern."
-                )
-            years = sorted({int(y) for y in matches})
-            max_year = max(years)
-            item_id = str(max_year)
-            year = str(max_year)
-            logger.info(
-                f"Detected single year in filename '{tif_file}': id={item_id}, year={year}"
-            )
-
-        if item_id in seen_ids:
-            raise ValueError(
-                f"ERROR: Duplicate item id '{item_id}' derived from .tif files."
-            )
-        seen_ids.add(item_id)
-
-        items.append(
-            {
-                "id": item_id,
-                "year": year,
-                "assets": {"input_file": tif_file},
-            }
-        )
-
-    items.sort(key=lambda it: int(it["year"]))
-
-    out = deepcopy(base)
-    out["items"] = items
-
-    target_path = output_path or template_path
-
-    if make_backup and path.isfile(template_path):
-        from datetime import datetime as _dt
-
-        ts = _dt.now().strftime("%Y%m%d-%H%M%S")
-
-        if backup_dir:
-            dest_dir = backup_dir
-        elif output_path:
-            dest_dir = path.dirname(output_path) or "."
-        else:
-            dest_dir = input_folder
-
-        os.makedirs(dest_dir, exist_ok=True)
-        backup_path = path.join(dest_dir, f"collection.backup.{ts}.json")
-
-        with open(backup_path, "w", encoding="utf-8") as fb:
-            json.dump(base, fb, ensure_ascii=False, indent=2)
-        logger.info(f"Backup saved at: {path.abspath(backup_path)}")
-
-    os.makedirs(path.dirname(target_path) or ".", exist_ok=True)
-    with open(target_path, "w", encoding="utf-8") as fo:
-        json.dump(out, fo, ensure_ascii=False, indent=2)
-
-    logger.info(f"Collection JSON updated at: {path.abspath(target_path)}")
@@ -12,6 +12,29 @@ class Settings(BaseSettings):
     username_auth: str = "admin"
     password_auth: str = "admin"
     token: str = ""
+    token_cache_path: str = "~/.cache/stac-data-tools/token.json"
+    token_refresh_margin: int = 60
+    token_max_age: int = 3600
+    log_format: str = "text"
+    log_level: str = "INFO"
+    metadata_workers: int = 8
+    metadata_cache_size: int = 1000
+    metadata_cache_hash: bool = False
+    cog_workers: int = 1
+    gdal_cachemax_mb: int = 1024
+    cog_num_threads: int = 0
+    upload_workers: int = 4
+    upload_max_concurrency: int = 8
+    upload_block_size_mb: int = 8
+    delete_workers: int = 4
+    pipeline_queue_size: int = 2
+    http_pool_size: int = 10
+    http_retries: int = 5
+    http_backoff: float = 0.5
+    stac_page_size: int = 100
+    stac_bulk_mode: str = "auto"
+    stac_bulk_size: int = 100
+    register_concurrency: int = 8
 
     model_config = SettingsConfigDict(env_file=".env")
 
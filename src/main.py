@@ -1,16 +1,28 @@
 from argparse import ArgumentParser
+from glob import glob
 from json import load
-from os import getcwd
+from os import getcwd, path
 from sys import exit as sysexit
 
-from collection import Collection, update_collection_json_inplace
-from utils import spec
-from utils.auth import authenticate
+from config import get_settings
+from utils.inject import infer_item_id_and_year, update_collection_json_inplace
+from utils.journal import RunJournal, input_fingerprint
 from utils.logging_config import logger
+from utils.metrics import metrics
 
+# Heavy dependencies (rasterio, GDAL, pystac, jsonschema, the Azure SDK) are
+# imported only by the commands that use them, so that offline commands such
+# as inject start quickly. Only these commands talk to the STAC server.
+SERVER_COMMANDS = ("create", "remove", "add-item")
+COLLECTION_COMMANDS = ("create", "validate", "remove", "add-item")
 
-def create_collection_local(collection, input_folder, collection_name):
+
+def create_collection_local(
+    collection, input_folder, collection_name, cache=None, checksums=False
+):
     """Read and validate local collection.json, load items, and build pystac objects."""
+    from utils import spec
+
     spec.validate_input_folder(input_folder)
 
     with open(f"{input_folder}/collection.json", "r") as f:
@@ -20,7 +32,7 @@ def create_collection_local(collection, input_folder, collection_name):
     spec.validate_format(data)
     spec.validate_layers(input_folder, raw_items)
 
-    collection.load_items(input_folder, raw_items)
+    collection.load_items(input_folder, raw_items, cache, checksums)
 
     collection.create_collection(collection_name, data)
     logger.info("Collection created successfully.")
@@ -29,8 +41,45 @@ def create_collection_local(collection, input_folder, collection_name):
     logger.info("Items created successfully.")
 
 
-def main():
+def expand_input_files(input_folder, patterns):
+    """
+    Expand filenames and glob patterns relative to the input folder into
+    the sorted, unique list of matching filenames.
+    """
+    file_names = set()
+    for pattern in patterns:
+        matches = glob(path.join(input_folder, pattern))
+        if not matches:
+            sysexit(f"Error: No file matches {pattern} in {input_folder}")
+        file_names.update(
+            path.relpath(match, input_folder) for match in matches
+        )
+    return sorted(file_names)
+
+
+def get_metadata_cache(folder, no_cache):
+    """Open the metadata cache of output/<folder>, unless disabled."""
+    if no_cache:
+        return None
+
+    from utils.metadata_cache import MetadataCache
+
+    settings = get_settings()
+    return MetadataCache(
+        f"{getcwd()}/output/{folder}/_cache/metadata.json",
+        max_entries=settings.metadata_cache_size,
+        hash_content=settings.metadata_cache_hash,
+    )
+
+
+def build_parser():
     parser = ArgumentParser(description="STAC Collection Manager")
+    parser.add_argument(
+        "--metrics-out",
+        dest="metrics_out",
+        help="Write a JSON report of the time, throughput and memory of "
+        "each stage to this file when the command ends",
+    )
     sub_parsers = parser.add_subparsers(dest="command", help="Commands")
 
     create_parser = sub_parsers.add_parser(
@@ -66,6 +115,77 @@ def main():
         help="(Opcional) Elimina los COG locales en la carpeta de salida luego de subirlos",
         required=False,
     )
+    create_parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        help="Number of parallel COG conversion processes",
+        required=False,
+    )
+    create_parser.add_argument(
+        "--pipeline",
+        dest="pipeline",
+        action="store_true",
+        help="Stream each item through conversion, upload and registration",
+        required=False,
+    )
+    create_parser.add_argument(
+        "--queue-size",
+        dest="queue_size",
+        type=int,
+        help="Items buffered between pipeline stages (with --pipeline)",
+        required=False,
+    )
+
+    create_parser.add_argument(
+        "--async-register",
+        dest="async_register",
+        action="store_true",
+        help="Register items concurrently with the async engine",
+    )
+    create_parser.add_argument(
+        "--register-concurrency",
+        dest="register_concurrency",
+        type=int,
+        help="Maximum item registrations in flight (with --async-register)",
+    )
+
+    create_parser.add_argument(
+        "--footprint",
+        dest="footprint",
+        choices=["bbox", "data"],
+        default="bbox",
+        help="Item footprint: bounding box or outline of the valid data",
+    )
+    create_parser.add_argument(
+        "--stats",
+        dest="stats",
+        choices=["approx", "exact"],
+        help="Compute band statistics and histograms for raster:bands",
+        required=False,
+    )
+    create_parser.add_argument(
+        "--sync",
+        dest="sync",
+        action="store_true",
+        help="Publish only new or changed items and remove deleted ones",
+        required=False,
+    )
+    create_parser.add_argument(
+        "--no-resume",
+        dest="no_resume",
+        action="store_true",
+        help="Start over instead of resuming an interrupted run",
+        required=False,
+    )
+    create_parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        action="store_true",
+        help="Read every raster header instead of using the metadata cache",
+        required=False,
+    )
 
     validate_parser = sub_parsers.add_parser(
         "validate", help="Validate collection specification"
@@ -85,6 +205,21 @@ def main():
         required=False,
     )
 
+    validate_parser.add_argument(
+        "--footprint",
+        dest="footprint",
+        choices=["bbox", "data"],
+        default="bbox",
+        help="Item footprint: bounding box or outline of the valid data",
+    )
+    validate_parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        action="store_true",
+        help="Read every raster header instead of using the metadata cache",
+        required=False,
+    )
+
     remove_parser = sub_parsers.add_parser(
         "remove", help="Remove indicated collection"
     )
@@ -141,9 +276,10 @@ def main():
     )
     add_item_parser.add_argument(
         "--file",
-        dest="file",
+        dest="files",
+        nargs="+",
         required=True,
-        help="TIF filename to add as an item",
+        help="TIF filenames or glob patterns (e.g. '*.tif') to add as items",
     )
     add_item_parser.add_argument(
         "--item-id",
@@ -153,8 +289,7 @@ def main():
     add_item_parser.add_argument(
         "--year",
         dest="year",
-        required=True,
-        help="Year associated with the item",
+        help="Year associated with the item (optional, inferred from filename)",
     )
     add_item_parser.add_argument(
         "--delete-local-cog",
@@ -162,30 +297,131 @@ def main():
         action="store_true",
         help="(Optional) Delete local COG after upload",
     )
+    add_item_parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        help="Number of parallel COG conversion processes",
+    )
 
-    args = parser.parse_args()
+    add_item_parser.add_argument(
+        "--footprint",
+        dest="footprint",
+        choices=["bbox", "data"],
+        default="bbox",
+        help="Item footprint: bounding box or outline of the valid data",
+    )
+    add_item_parser.add_argument(
+        "--stats",
+        dest="stats",
+        choices=["approx", "exact"],
+        help="Compute band statistics and histograms for raster:bands",
+    )
+    add_item_parser.add_argument(
+        "--async-register",
+        dest="async_register",
+        action="store_true",
+        help="Register items concurrently with the async engine",
+    )
+    add_item_parser.add_argument(
+        "--register-concurrency",
+        dest="register_concurrency",
+        type=int,
+        help="Maximum item registrations in flight (with --async-register)",
+    )
+
+    return parser
+
+
+def run_command(args):
+    if getattr(args, "register_concurrency", None) and not args.async_register:
+        sysexit("Error: --register-concurrency requires --async-register")
+    if getattr(args, "pipeline", False) and args.async_register:
+        sysexit(
+            "Error: --pipeline registers each item as soon as it is "
+            "uploaded and cannot be combined with --async-register"
+        )
+
+    if args.command in SERVER_COMMANDS:
+        from utils.auth import get_token
+
+        get_token()
+
+    if args.command in COLLECTION_COMMANDS:
+        from collection import Collection
 
-    authenticate()
-    collection = Collection()
+        collection = Collection()
+
+        if getattr(args, "async_register", False):
+            collection.register_concurrency = (
+                args.register_concurrency
+                or get_settings().register_concurrency
+            )
+        collection.stats_mode = getattr(args, "stats", None)
+        collection.footprint_mode = getattr(args, "footprint", "bbox")
 
     if args.command == "create":
         input_folder = f"input/{args.folder}"
-        create_collection_local(collection, input_folder, args.collection)
+        create_collection_local(
+            collection,
+            input_folder,
+            args.collection,
+            get_metadata_cache(args.folder, args.no_cache),
+            checksums=args.sync,
+        )
+
+        output_dir = f"{getcwd()}/output/{args.folder}"
+
+        # -o replaces the collection, so it starts over like --no-resume.
+        journal_path = f"{output_dir}/_state/create.json"
+        collection.journal = RunJournal(
+            journal_path,
+            collection.stac_collection.id,
+            input_fingerprint(input_folder, collection.items),
+            resume=not (args.no_resume or args.overwrite),
+        )
+
+        if collection.journal.mismatch:
+            sysexit(
+                f"Error: Cannot resume the run saved in {journal_path}: "
+                f"{collection.journal.mismatch}. Use -o to replace the "
+                "collection or --no-resume to start over."
+            )
 
-        if collection.check_collection(args.overwrite):
+        if collection.journal.resuming:
+            logger.info("Resuming interrupted run of the collection.")
+        elif not args.sync and collection.check_collection(args.overwrite):
             collection.remove_collection()
             logger.info("Previous collection removed.")
 
-        output_dir = f"{getcwd()}/output/{args.folder}"
+        if args.sync:
+            collection.plan_sync()
 
-        collection.convert_layers(input_folder, output_dir)
-        logger.info("Layers converted successfully.")
+        if args.pipeline:
+            collection.publish_pipeline(
+                input_folder,
+                output_dir,
+                args.workers,
+                args.queue_size,
+                args.delete_local_cog,
+            )
+            logger.info("Collection published successfully.")
+        else:
+            collection.convert_layers(input_folder, output_dir, args.workers)
+            logger.info("Layers converted successfully.")
 
-        collection.upload_layers(output_dir)
-        logger.info("Layers uploaded successfully.")
+            collection.upload_layers(output_dir)
+            logger.info("Layers uploaded successfully.")
+
+            collection.upload_collection()
+            logger.info("Collection uploaded successfully.")
+
+        if args.sync:
+            collection.remove_stale_items()
+            logger.info("Removed items deleted from the collection.")
 
-        collection.upload_collection()
-        logger.info("Collection uploaded successfully.")
+        collection.journal.discard()
 
         if args.delete_local_cog:
             collection.clean_local_cogs(output_dir)
@@ -194,7 +430,10 @@ def main():
 
     elif args.command == "validate":
         create_collection_local(
-            collection, f"input/{args.folder}", args.collection
+            collection,
+            f"input/{args.folder}",
+            args.collection,
+            get_metadata_cache(args.folder, args.no_cache),
         )
         sysexit("Validation successful.")
 
@@ -224,100 +463,148 @@ def main():
     elif args.command == "add-item":
         from datetime import datetime
 
-        from utils import raster
+        from pystac import Collection as PySTACCollection
 
-        # Get collection and existing items from server
-        collection_data, existing_items = (
-            collection.get_collection_from_server(args.collection)
-        )
+        from utils import raster
 
-        # Process the new item file
         input_folder = f"input/{args.folder}"
-        file_path = f"{input_folder}/{args.file}"
+        file_names = expand_input_files(input_folder, args.files)
 
-        logger.info(f"Processing file: {file_path}")
+        if len(file_names) > 1 and (args.item_id or args.year):
+            sysexit(
+                "Error: --item-id and --year can only be used with a single file"
+            )
 
-        # Get metadata from TIF file
-        bbox, footprint, crs, resolution, dtype = raster.get_tif_metadata(
-            file_path
+        # Get collection and existing items from server, only once
+        collection_data, existing_items = (
+            collection.get_collection_from_server(args.collection)
+        )
+        specs = collection.describe_collection_specs(
+            collection_data, existing_items
         )
 
-        # Get or infer EPSG
-        epsg = None
-        if isinstance(crs, int):
-            epsg = crs
-        else:
-            logger.warning(f"Could not determine EPSG from CRS: {crs}")
-
-        # Infer item ID from filename or use provided
-        item_id = args.item_id or args.file.replace(".tif", "")
-
-        # Create item data
-        item_data = {
-            "id": item_id,
-            "year": args.year,
-            "bbox": bbox,
-            "footprint": footprint,
-            "resolution": resolution,
-            "dtype": dtype,
-            "input_file": args.file,
-            "datetime": datetime(int(args.year), 1, 1),
-            "properties": {"proj:epsg": epsg} if epsg else {},
-        }
-
-        # Validate item against collection
-        collection.validate_item_against_collection(
-            item_data, collection_data, existing_items
+        file_paths = [f"{input_folder}/{name}" for name in file_names]
+        metadatas = raster.scan_metadata(
+            file_paths,
+            get_settings().metadata_workers,
+            footprint_mode=collection.footprint_mode,
         )
 
-        # Use existing collection from server (convert dict to PySTAC Collection)
-        from pystac import Collection as PySTACCollection
+        errors = []
+        for file_name, metadata in zip(file_names, metadatas):
+            logger.info(f"Processing file: {input_folder}/{file_name}")
+
+            epsg = metadata.epsg
+            if epsg is None:
+                logger.warning(
+                    f"Could not determine EPSG from CRS: {metadata.crs}"
+                )
+
+            # The id and year come from the file name, as in inject, unless
+            # --item-id or --year are given.
+            item_id, year = args.item_id, args.year
+            if not (item_id and year):
+                try:
+                    inferred_id, inferred_year = infer_item_id_and_year(
+                        file_name
+                    )
+                except ValueError as e:
+                    errors.append(str(e))
+                    continue
+                item_id = item_id or inferred_id
+                year = year or inferred_year
+
+            item_data = {
+                "id": item_id,
+                "year": year,
+                "bbox": metadata.bbox,
+                "native_bbox": metadata.native_bbox,
+                "footprint": metadata.footprint,
+                "resolution": metadata.resolution,
+                "dtype": metadata.dtype,
+                "input_file": file_name,
+                "datetime": datetime(int(year), 1, 1),
+                "properties": {"proj:epsg": epsg} if epsg else {},
+            }
+
+            # Validate item against collection
+            try:
+                collection.validate_item_against_specs(item_data, specs)
+            except ValueError as e:
+                errors.append(f"{file_name}: {e}")
+                continue
+
+            collection.items.append(item_data)
+            collection.dates.append(year)
+            collection.longs.extend([metadata.bbox[0], metadata.bbox[2]])
+            collection.lats.extend([metadata.bbox[1], metadata.bbox[3]])
+
+        item_ids = [item["id"] for item in collection.items]
+        duplicates = sorted({i for i in item_ids if item_ids.count(i) > 1})
+        if duplicates:
+            errors.append(f"Duplicate item ids: {', '.join(duplicates)}")
+
+        if errors:
+            for error in errors:
+                logger.error(error)
+            sysexit(
+                f"Error: {len(errors)} of {len(file_names)} files are not "
+                f"valid items of collection {args.collection}"
+            )
 
+        # Use existing collection from server (convert dict to PySTAC Collection)
         collection.stac_collection = PySTACCollection.from_dict(
             collection_data
         )
-
-        # Load and create the item
-        collection.items = [item_data]
-        collection.dates = [args.year]
-        collection.longs = [bbox[0], bbox[2]]
-        collection.lats = [bbox[1], bbox[3]]
-
         collection.create_items()
 
-        # Convert to COG
+        # Convert to COG and upload the layers
         output_dir = f"{getcwd()}/output/{args.folder}"
-        collection.convert_layers(input_folder, output_dir)
-        logger.info("Layer converted to COG successfully.")
+        collection.convert_layers(input_folder, output_dir, args.workers)
+        logger.info("Layers converted to COG successfully.")
 
-        # Upload layer and item
         collection.upload_layers(output_dir)
-        logger.info("Layer uploaded successfully.")
+        logger.info("Layers uploaded successfully.")
 
-        # Upload single item to server
-        success = collection.upload_single_item(item_data)
-        if success:
-            logger.info(
-                f"Item {item_id} added to collection {args.collection} successfully."
+        # Register the items in the server collection
+        try:
+            collection.register_items(
+                list(zip(collection.items, collection.stac_items))
             )
-        else:
+        except Exception as e:
             logger.error(
-                f"Failed to add item {item_id} to collection {args.collection}"
+                f"Failed to add items to collection {args.collection}: {e}"
             )
             sysexit(
-                f"Error: Failed to add item {item_id} to collection {args.collection}"
+                f"Error: Failed to add items to collection {args.collection}"
             )
 
         if args.delete_local_cog:
             collection.clean_local_cogs(output_dir)
 
         sysexit(
-            f"Item {item_id} added successfully to collection {args.collection}."
+            f"Items {', '.join(item_ids)} added successfully to collection "
+            f"{args.collection}."
         )
 
     else:
         sysexit("No command used. Type -h for help")
 
 
+def main():
+    args = build_parser().parse_args()
+
+    if args.metrics_out:
+        metrics.enable()
+    try:
+        run_command(args)
+    finally:
+        # Commands end with sysexit, so the report is written on the way out,
+        # also when they fail.
+        if args.metrics_out:
+            metrics.write_report(args.metrics_out, args.command)
+            logger.info(f"Metrics written to {args.metrics_out}")
+
+
 if __name__ == "__main__":
     main()
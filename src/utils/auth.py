@@ -1,9 +1,17 @@
+import base64
+import json
+import os
+import time
+from functools import lru_cache
+from os import path
 from sys import exit as sysexit
+from threading import Lock
 
 import requests
 
 from config import get_settings
 from utils.logging_config import logger
+from utils.session import get_session
 from utils.url import build_url
 
 settings = get_settings()
@@ -22,7 +30,7 @@ def authenticate():
         auth_data = {"username": username, "password": password}
 
         url = build_url(stac_url, auth_url, args_dict={})
-        response = requests.post(url, data=auth_data)
+        response = get_session().post(url, data=auth_data)
         response.raise_for_status()
 
         new_token = response.json().get("access_token")
@@ -57,3 +65,158 @@ def authenticate():
 
     except requests.RequestException as req_err:
         sysexit(f"Request error: {req_err}")
+
+
+def token_expiry(token):
+    """
+    Read the expiry (exp claim, seconds since the epoch) of a JWT without
+    verifying it. Return None if the token is not a JWT or has no exp.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """
+    Keeps the token of the STAC server for all the threads of a run. The
+    token is cached on disk (readable only by the user) so later runs reuse
+    it, and it is renewed before it expires instead of after a 401. Tokens
+    without a readable expiry are renewed max_age seconds after the login.
+    A token the server rejects is dropped, from memory and disk.
+    """
+
+    def __init__(self, cache_path="", refresh_margin=60, max_age=3600):
+        self.cache_path = path.expanduser(cache_path) if cache_path else ""
+        self.refresh_margin = refresh_margin
+        self.max_age = max_age
+        self.token = None
+        self.obtained_at = None
+        self.expires_at = None
+        self.lock = Lock()
+        self.loaded = False
+
+    def get_token(self):
+        """
+        Return a valid token, reading it from the disk cache or logging in
+        again if it is missing or about to expire.
+        """
+        with self.lock:
+            if not self.loaded:
+                self.loaded = True
+                self._load()
+            if self.token is None or self._expiring():
+                self._refresh()
+            return self.token
+
+    def invalidate(self, token):
+        """
+        Discard a token the server rejected, and its disk cache, unless
+        another thread already replaced it.
+        """
+        with self.lock:
+            if self.token != token:
+                return
+            self.token = None
+            self.obtained_at = None
+            self.expires_at = None
+            if self.cache_path:
+                try:
+                    os.remove(self.cache_path)
+                except FileNotFoundError:
+                    pass
+
+    def _expiring(self):
+        return (
+            self.expires_at is not None
+            and time.time() >= self.expires_at - self.refresh_margin
+        )
+
+    def _refresh(self):
+        authenticate()
+        self.token = settings.token
+        self.obtained_at = time.time()
+        self.expires_at = self._expiry()
+        self._save()
+
+    def _expiry(self):
+        """
+        Expiry of the token: its exp claim or, without one, max_age seconds
+        after it was obtained.
+        """
+        expires_at = token_expiry(self.token)
+        if expires_at is None and self.max_age:
+            expires_at = (self.obtained_at or 0) + self.max_age
+        return expires_at
+
+    def _owner(self):
+        return {
+            "stac_url": settings.stac_url,
+            "username": settings.username_auth,
+        }
+
+    def _load(self):
+        if not self.cache_path or not path.isfile(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable token cache: {e}")
+            return
+
+        if cached.get("owner") != self._owner():
+            return
+        self.token = cached.get("token")
+        self.obtained_at = cached.get("obtained_at")
+        self.expires_at = self._expiry() if self.token else None
+        if self.token and not self._expiring():
+            settings.set_token(self.token)
+            logger.info("Using cached token.")
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        cache_dir = path.dirname(self.cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+        tmp_path = f"{self.cache_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "owner": self._owner(),
+                    "token": self.token,
+                    "obtained_at": self.obtained_at,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.cache_path)
+
+
+@lru_cache
+def get_token_manager():
+    return TokenManager(
+        settings.token_cache_path,
+        settings.token_refresh_margin,
+        settings.token_max_age,
+    )
+
+
+def get_token():
+    """
+    Get a valid token for the STAC server, shared by all threads.
+    """
+    return get_token_manager().get_token()
+
+
+def invalidate_token(token):
+    """
+    Drop a token the server rejected, so the next get_token logs in again.
+    """
+    get_token_manager().invalidate(token)
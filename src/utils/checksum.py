@@ -0,0 +1,15 @@
+import hashlib
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def file_digest(file_path, algorithm="md5"):
+    """
+    Hash a file in a single streaming pass, without loading it into memory.
+    Return the hashlib object so callers can pick digest() or hexdigest().
+    """
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
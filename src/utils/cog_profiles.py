@@ -0,0 +1,52 @@
+from utils.spec import CollectionDataType
+
+# COG creation options for each profile, on top of the common ones used by
+# raster.tif_to_cog. "default" keeps the original settings. PREDICTOR=YES
+# lets GDAL use the horizontal predictor (2) for integer rasters and the
+# floating point one (3) for float rasters.
+COG_PROFILES = {
+    "default": ["COMPRESS=DEFLATE"],
+    "classified": [
+        "COMPRESS=ZSTD",
+        "PREDICTOR=YES",
+        "RESAMPLING=MODE",
+    ],
+    "classified-deflate": [
+        "COMPRESS=DEFLATE",
+        "PREDICTOR=YES",
+        "RESAMPLING=MODE",
+    ],
+    "continuous": [
+        "COMPRESS=ZSTD",
+        "PREDICTOR=YES",
+        "RESAMPLING=AVERAGE",
+    ],
+    "continuous-lerc": [
+        "COMPRESS=LERC_ZSTD",
+        "MAX_Z_ERROR=0",
+        "RESAMPLING=AVERAGE",
+    ],
+}
+
+AUTO_PROFILE = "auto"
+
+INTEGER_DTYPES = ("uint8", "ubyte", "uint16", "uint32", "int16", "int32")
+FLOAT_DTYPES = ("float32", "float", "float64", "double")
+
+
+def select_cog_profile(dtype, data_type=None):
+    """
+    Pick a COG profile from the collection data type (Clasificada or
+    Continua) or, if it is not set, from the item dtype.
+    """
+    if data_type == CollectionDataType.CLASSIFIED.value:
+        return "classified"
+    if data_type == CollectionDataType.CONTINUOUS.value:
+        return "continuous"
+
+    dtype = (dtype or "").lower()
+    if dtype in INTEGER_DTYPES:
+        return "classified"
+    if dtype in FLOAT_DTYPES:
+        return "continuous"
+    return "default"
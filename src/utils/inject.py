@@ -0,0 +1,135 @@
+import json
+import os
+import re
+from copy import deepcopy
+from os import path
+
+from utils.logging_config import logger
+
+RANGE_PATTERN = re.compile(r"(?P<start>\d{4})\s*[-_]\s*(?P<end>\d{4})")
+YEAR_PATTERN = re.compile(r"(\d{4})")
+
+
+def infer_item_id_and_year(tif_file):
+    """
+    Infer the item id and year from a .tif filename:
+      - If a range like '2006-2010' or '2006_2010' is found, the item id is '2006-2010'
+        and 'year' will be the highest year ('2010').
+      - If only single years are found, id = that year and 'year' = that same year.
+    """
+    rng = RANGE_PATTERN.search(tif_file)
+    if rng:
+        start = int(rng.group("start"))
+        end = int(rng.group("end"))
+        if start > end:
+            start, end = end, start
+        item_id = f"{start}-{end}"
+        year = str(end)
+        logger.info(
+            f"Detected period in filename '{tif_file}': id={item_id}, year={year}"
+        )
+        return item_id, year
+
+    matches = YEAR_PATTERN.findall(tif_file)
+    if not matches:
+        raise ValueError(
+            f"ERROR: '{tif_file}' does not contain a 4-digit year or year range. "
+            "Rename the file or adjust the detection pattern."
+        )
+    years = sorted({int(y) for y in matches})
+    max_year = max(years)
+    item_id = str(max_year)
+    year = str(max_year)
+    logger.info(
+        f"Detected single year in filename '{tif_file}': id={item_id}, year={year}"
+    )
+    return item_id, year
+
+
+def update_collection_json_inplace(
+    input_folder: str,
+    output_path: str | None = None,
+    make_backup: bool = True,
+    backup_dir: str | None = None,
+):
+    """
+    Read input/<folder>/collection.json, scan .tif files in that folder,
+    create items from years/ranges in filenames (see infer_item_id_and_year).
+    Overwrite collection.json injecting the generated 'items', or write to output_path.
+    If backup_dir is provided, write the backup there; otherwise next to target.
+    """
+    abs_input = path.abspath(input_folder)
+    if not path.isdir(input_folder):
+        raise ValueError(f"Input folder does not exist: {abs_input}")
+
+    template_path = path.join(input_folder, "collection.json")
+    abs_template = path.abspath(template_path)
+    if not path.isfile(template_path):
+        raise FileNotFoundError(
+            f"collection.json not found at: {abs_template}"
+        )
+
+    logger.info(f"Reading base collection from: {abs_template}")
+
+    with open(template_path, "r", encoding="utf-8") as f:
+        base = json.load(f)
+
+    tif_files = [
+        f for f in os.listdir(input_folder) if f.lower().endswith(".tif")
+    ]
+    if not tif_files:
+        raise ValueError(f"No .tif files found in {abs_input}")
+
+    logger.info(f"Found {len(tif_files)} .tif files in {abs_input}")
+
+    items = []
+    seen_ids = set()
+
+    for tif_file in sorted(tif_files):
+        item_id, year = infer_item_id_and_year(tif_file)
+
+        if item_id in seen_ids:
+            raise ValueError(
+                f"ERROR: Duplicate item id '{item_id}' derived from .tif files."
+            )
+        seen_ids.add(item_id)
+
+        items.append(
+            {
+                "id": item_id,
+                "year": year,
+                "assets": {"input_file": tif_file},
+            }
+        )
+
+    items.sort(key=lambda it: int(it["year"]))
+
+    out = deepcopy(base)
+    out["items"] = items
+
+    target_path = output_path or template_path
+
+    if make_backup and path.isfile(template_path):
+        from datetime import datetime as _dt
+
+        ts = _dt.now().strftime("%Y%m%d-%H%M%S")
+
+        if backup_dir:
+            dest_dir = backup_dir
+        elif output_path:
+            dest_dir = path.dirname(output_path) or "."
+        else:
+            dest_dir = input_folder
+
+        os.makedirs(dest_dir, exist_ok=True)
+        backup_path = path.join(dest_dir, f"collection.backup.{ts}.json")
+
+        with open(backup_path, "w", encoding="utf-8") as fb:
+            json.dump(base, fb, ensure_ascii=False, indent=2)
+        logger.info(f"Backup saved at: {path.abspath(backup_path)}")
+
+    os.makedirs(path.dirname(target_path) or ".", exist_ok=True)
+    with open(target_path, "w", encoding="utf-8") as fo:
+        json.dump(out, fo, ensure_ascii=False, indent=2)
+
+    logger.info(f"Collection JSON updated at: {path.abspath(target_path)}")
@@ -0,0 +1,106 @@
+import json
+import os
+from os import path
+from threading import Lock
+
+from utils.logging_config import logger
+
+
+def input_fingerprint(input_dir, items):
+    """
+    Describe the inputs of a run: the input file of each item id with its
+    size and modification time.
+    """
+    fingerprint = {}
+    for item in items:
+        file_path = path.join(input_dir, item["input_file"])
+        stat = os.stat(file_path)
+        fingerprint[item["id"]] = [
+            item["input_file"],
+            stat.st_size,
+            stat.st_mtime_ns,
+        ]
+    return fingerprint
+
+
+class RunJournal:
+    """
+    Progress record of a create run, saved to disk after every change.
+    For each item it keeps whether its COG was converted, the URL it was
+    uploaded to and whether it was registered, so an interrupted run can
+    resume from the first unfinished step of each item.
+    A journal is only resumed by a run of the same collection with the same
+    inputs (see input_fingerprint); otherwise mismatch is set and the run
+    must start over explicitly.
+    """
+
+    def __init__(self, journal_path, collection_id, inputs, resume=True):
+        self.journal_path = journal_path
+        self.collection_id = collection_id
+        self.inputs = inputs
+        self.items = {}
+        self.resuming = False
+        self.mismatch = None
+        self.lock = Lock()
+
+        if resume and path.isfile(journal_path):
+            try:
+                with open(journal_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable run journal: {e}")
+                return
+
+            if data.get("collection_id") != collection_id:
+                self.mismatch = (
+                    f"it belongs to collection {data.get('collection_id')}"
+                )
+            elif data.get("inputs") != inputs:
+                self.mismatch = "the input files changed since it was written"
+            else:
+                self.items = data.get("items", {})
+                self.resuming = True
+
+    def get(self, item_id, stage):
+        """
+        Get the recorded value of a stage for an item, or None.
+        """
+        with self.lock:
+            return self.items.get(item_id, {}).get(stage)
+
+    def mark(self, item_id, stage, value=True):
+        """
+        Record the value of a stage for an item and save the journal.
+        """
+        with self.lock:
+            self.items.setdefault(item_id, {})[stage] = value
+            self._save()
+
+    def discard(self):
+        """
+        Remove the journal once the run has completed.
+        """
+        if path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+
+        journal_dir = path.dirname(self.journal_path)
+        if (
+            journal_dir
+            and path.isdir(journal_dir)
+            and not os.listdir(journal_dir)
+        ):
+            os.rmdir(journal_dir)
+
+    def _save(self):
+        os.makedirs(path.dirname(self.journal_path) or ".", exist_ok=True)
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "collection_id": self.collection_id,
+                    "inputs": self.inputs,
+                    "items": self.items,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.journal_path)
@@ -1,20 +1,174 @@
+import atexit
+import copy
+import json
 import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
-logging.basicConfig(
-    filename="collection_process.log",
-    filemode="a",
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+from config import get_settings
+
+LOG_FILE = "collection_process.log"
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(correlation)s%(message)s"
+
+# Id of the item (or file) being processed by the current thread or task,
+# added to every record logged while it is set.
+correlation_id = ContextVar("correlation_id", default=None)
+
+
+@contextmanager
+def log_context(item_id):
+    """
+    Tag the records logged inside the block with item_id as correlation id.
+    """
+    token = correlation_id.set(item_id)
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
+
+
+class CorrelationFilter(logging.Filter):
+    """
+    Add the current correlation id to each record, in the thread that logs
+    it (context variables are not visible from the listener thread).
+    """
+
+    def filter(self, record):
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = correlation_id.get()
+        record.correlation = (
+            f"[{record.correlation_id}] " if record.correlation_id else ""
+        )
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyJson:
+    """
+    Payload for a log argument that is serialized only if the record is
+    emitted: logger.debug("Payload: %s", LazyJson(obj.to_dict)).
+    """
+
+    def __init__(self, build):
+        self.build = build
+
+    def __str__(self):
+        return json.dumps(self.build(), default=str)
+
+
+def build_handlers(log_format):
+    """
+    File handler for every logger, and console handler for the records of
+    this tool only, both with the text or JSON format.
+    """
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    file_handler = logging.FileHandler(LOG_FILE, mode="a")
+    file_handler.setFormatter(formatter)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(formatter)
+    console_handler.addFilter(logging.Filter(__name__))
+
+    return [file_handler, console_handler]
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves the formatting to the listener: it only
+    merges the arguments into the message (so records can be pickled and
+    arguments are not mutated before they are written) and keeps the
+    traceback apart, for the JSON format.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.addFilter(CorrelationFilter())
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+        record.exc_info = None
+        return record
+
+
+settings = get_settings()
+
+# Records are put on a queue and written by a listener thread, so threads
+# that log never wait for the file or the console.
+handlers = build_handlers(settings.log_format.lower())
+listener = QueueListener(SimpleQueue(), *handlers, respect_handler_level=True)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(settings.log_level.upper())
+root_logger.addHandler(RecordQueueHandler(listener.queue))
 
 logger = logging.getLogger(__name__)
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+listener.start()
+atexit.register(listener.stop)
+
+process_listener = None
+
+
+def get_process_queue():
+    """
+    Queue for the records of worker processes, written by a second listener
+    of this process. Pass it to init_worker_logging as pool initializer.
+    """
+    global process_listener
+    if process_listener is None:
+        from multiprocessing import Queue
+
+        process_listener = QueueListener(
+            Queue(), *handlers, respect_handler_level=True
+        )
+        process_listener.start()
+        atexit.register(process_listener.stop)
+    return process_listener.queue
 
-console_formatter = logging.Formatter(
-    "%(asctime)s - %(levelname)s - %(message)s"
-)
-console_handler.setFormatter(console_formatter)
 
-logger.addHandler(console_handler)
+def init_worker_logging(queue):
+    """
+    Send the records of a worker process to the queue of its parent instead
+    of the handlers it inherited.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(RecordQueueHandler(queue))
@@ -0,0 +1,133 @@
+import json
+import os
+from collections import OrderedDict
+from dataclasses import asdict
+from os import path
+from threading import Lock
+
+from utils.checksum import file_digest
+from utils.logging_config import logger
+from utils.raster import RasterMetadata
+
+CACHE_VERSION = 2
+
+
+class MetadataCache:
+    """
+    On-disk cache of raster metadata, stored as a JSON sidecar file.
+    Entries are keyed by the absolute file path and only reused while the
+    file fingerprint (size, modification time and, optionally, a content
+    hash) is unchanged. Beyond max_entries, the least recently used entries
+    are evicted. Files written with another CACHE_VERSION (an older layout of
+    RasterMetadata) are ignored.
+    """
+
+    def __init__(self, cache_path, max_entries=1000, hash_content=False):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hash_content = hash_content
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        if path.isfile(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable metadata cache: {e}")
+            else:
+                if data.get("version") == CACHE_VERSION:
+                    self.entries = OrderedDict(data["entries"])
+                else:
+                    logger.info("Ignoring metadata cache of another version")
+
+    def fingerprint(self, file_path):
+        """
+        Build the fingerprint of a file from its size and modification time,
+        plus its SHA-256 if hash_content is enabled.
+        """
+        stat = os.stat(file_path)
+        fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+        if self.hash_content:
+            fingerprint += f":{file_digest(file_path, 'sha256').hexdigest()}"
+        return fingerprint
+
+    def key(self, file_path, variant=None):
+        """
+        Build the key of a file entry. Metadata read with other options
+        (e.g. the footprint mode) is kept under its own variant.
+        """
+        key = path.abspath(file_path)
+        return f"{key}|{variant}" if variant else key
+
+    def get(self, file_path, variant=None):
+        """
+        Return the cached RasterMetadata of a file, or None if it is missing
+        or the file changed since it was cached.
+        """
+        key = self.key(file_path, variant)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry["fingerprint"] != self.fingerprint(
+            file_path
+        ):
+            return None
+
+        with self.lock:
+            self.entries.move_to_end(key)
+
+        metadata = dict(entry["metadata"])
+        metadata["block_shapes"] = [
+            tuple(shape) for shape in metadata["block_shapes"]
+        ]
+        return RasterMetadata(**metadata)
+
+    def put(self, file_path, metadata, variant=None):
+        """
+        Store the metadata of a file, evicting the least recently used
+        entries if the cache is full.
+        """
+        key = self.key(file_path, variant)
+        entry = {
+            "fingerprint": self.fingerprint(file_path),
+            "metadata": asdict(metadata),
+        }
+        self._store(key, entry)
+
+    def _store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def checksum(self, file_path):
+        """
+        Return the MD5 (hex) of a file. It is cached like the metadata, so
+        it is only computed again when the file changes.
+        """
+        key = self.key(file_path, "checksum")
+        fingerprint = self.fingerprint(file_path)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry["fingerprint"] == fingerprint:
+            with self.lock:
+                self.entries.move_to_end(key)
+            return entry["checksum"]
+
+        checksum = file_digest(file_path).hexdigest()
+        self._store(key, {"fingerprint": fingerprint, "checksum": checksum})
+        return checksum
+
+    def save(self):
+        """
+        Write the cache to disk, replacing the previous file atomically.
+        """
+        os.makedirs(path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with self.lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": CACHE_VERSION, "entries": self.entries}, f
+                )
+        os.replace(tmp_path, self.cache_path)
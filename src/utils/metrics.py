@@ -0,0 +1,327 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from os import makedirs, path
+from threading import Lock
+
+from utils.logging_config import log_context
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TOP_ALLOCATIONS = 10
+
+
+@dataclass
+class Span:
+    """
+    Timing of one unit of work of a stage (usually one item). bytes can be
+    set inside the span to report its throughput. peak_rss_mb is the peak
+    resident memory of the process while the span ran.
+    """
+
+    stage: str
+    item: str = None
+    seconds: float = 0.0
+    bytes: int = None
+    peak_rss_mb: float = None
+
+
+def peak_rss_mb(who=None):
+    """
+    Peak resident memory (MB) of this process, or of its finished child
+    processes with who=resource.RUSAGE_CHILDREN. None where unavailable.
+    """
+    if resource is None:
+        return None
+    if who is None:
+        who = resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def rss_mb():
+    """
+    Current and peak resident memory (MB) of this process, the peak since
+    the last reset_peak_rss(). (None, None) where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            fields = dict(line.partition(":")[::2] for line in f)
+    except OSError:
+        return None, None
+    return _kb_to_mb(fields.get("VmRSS")), _kb_to_mb(fields.get("VmHWM"))
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory of this process to the current one, so
+    it can be measured per span. This also resets ru_maxrss. Return False
+    where it is not supported (only Linux is).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def span_peak_rss_mb(reset, start_rss):
+    """
+    Peak resident memory (MB) of a span that started with start_rss: the
+    peak since the reset at its start or, where the peak could not be
+    reset, the largest of the RSS at its start and at its end.
+    """
+    rss, peak = rss_mb()
+    return peak if reset else _max(start_rss, rss)
+
+
+class Metrics:
+    """
+    Collects the duration of each stage (metadata reading, COG conversion,
+    upload, registration, validation) per item, the bytes moved, the peak
+    RSS and the Python allocations traced by tracemalloc, and writes them as
+    a JSON report. Disabled by default, spans then cost almost nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = Lock()
+        self.stages = {}
+        self.items = {}
+        self.active = 0
+        self.started = None
+        self.peak_reset = False
+        self.peak_rss_mb = None
+        self.children_peak_rss_mb = None
+
+    def enable(self, trace_memory=True):
+        """
+        Start collecting; with trace_memory, also trace Python allocations
+        (this slows down allocation-heavy code).
+        """
+        self.enabled = True
+        self.started = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def span(self, stage, item=None, nbytes=None):
+        """
+        Time the block as a unit of work of stage for item, and record the
+        peak RSS while it ran. Spans can run concurrently in several
+        threads. Records logged inside the block carry item as correlation
+        id, also when metrics are disabled.
+        """
+        span = Span(stage, item, bytes=nbytes)
+        with log_context(item) if item is not None else nullcontext():
+            if not self.enabled:
+                yield span
+                return
+
+            with self.lock:
+                # The peaks are reset only when no span is running, so a
+                # stage reports the peak reached while it (or an overlapping
+                # stage) was running.
+                if self.active == 0:
+                    if tracemalloc.is_tracing():
+                        tracemalloc.reset_peak()
+                    # Resetting also resets ru_maxrss: keep the peak so far
+                    # for the process peak of the report.
+                    self.peak_rss_mb = _max(self.peak_rss_mb, rss_mb()[1])
+                    self.peak_reset = reset_peak_rss()
+                self.active += 1
+            start_rss, _ = rss_mb()
+            start = time.perf_counter()
+            try:
+                yield span
+            finally:
+                span.seconds = time.perf_counter() - start
+                span.peak_rss_mb = span_peak_rss_mb(self.peak_reset, start_rss)
+                with self.lock:
+                    self.active -= 1
+                self.add(span, start)
+
+    def collect(self, result):
+        """
+        Record the span of a measure() call run in a worker process and
+        return the result of the measured function.
+        """
+        value, span = result
+        if self.enabled:
+            # Workers reset their peak RSS for each span, which also resets
+            # the ru_maxrss reported for them once they exit.
+            with self.lock:
+                self.children_peak_rss_mb = _max(
+                    self.children_peak_rss_mb, span.peak_rss_mb
+                )
+            self.add(span, time.perf_counter() - span.seconds, local=False)
+        return value
+
+    def add(self, span, start, local=True):
+        # Memory traced in this process says nothing of a span run in a
+        # worker process; its peak RSS is the worker's own.
+        traced = (
+            tracemalloc.get_traced_memory()
+            if local and tracemalloc.is_tracing()
+            else None
+        )
+        with self.lock:
+            stage = self.stages.setdefault(
+                span.stage,
+                {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "min_seconds": None,
+                    "max_seconds": 0.0,
+                    "first_start": start,
+                    "last_end": start,
+                    "bytes": 0,
+                    "peak_rss_mb": None,
+                    "peak_traced_mb": None,
+                },
+            )
+            stage["count"] += 1
+            stage["seconds"] += span.seconds
+            stage["min_seconds"] = min(
+                stage["min_seconds"] or span.seconds, span.seconds
+            )
+            stage["max_seconds"] = max(stage["max_seconds"], span.seconds)
+            stage["first_start"] = min(stage["first_start"], start)
+            stage["last_end"] = max(stage["last_end"], start + span.seconds)
+            stage["bytes"] += span.bytes or 0
+            if span.peak_rss_mb is not None:
+                stage["peak_rss_mb"] = max(
+                    stage["peak_rss_mb"] or 0, span.peak_rss_mb
+                )
+            if traced is not None:
+                stage["peak_traced_mb"] = max(
+                    stage["peak_traced_mb"] or 0, traced[1] / 2**20
+                )
+
+            if span.item is not None:
+                entry = {"seconds": round(span.seconds, 6)}
+                if span.bytes:
+                    entry["bytes"] = span.bytes
+                    entry["bytes_per_second"] = _rate(span.bytes, span.seconds)
+                self.items.setdefault(span.item, {})[span.stage] = entry
+
+    def report(self, command=None):
+        """
+        Build the report: totals per stage and per item, process and child
+        process peak RSS, and the top allocation sites still traced.
+        """
+        stages = {}
+        with self.lock:
+            for name, stage in self.stages.items():
+                wall = stage["last_end"] - stage["first_start"]
+                stages[name] = {
+                    "count": stage["count"],
+                    "seconds": round(stage["seconds"], 6),
+                    "wall_seconds": round(wall, 6),
+                    "mean_seconds": round(
+                        stage["seconds"] / stage["count"], 6
+                    ),
+                    "min_seconds": round(stage["min_seconds"], 6),
+                    "max_seconds": round(stage["max_seconds"], 6),
+                    "bytes": stage["bytes"],
+                    "bytes_per_second": _rate(stage["bytes"], wall),
+                    "peak_rss_mb": _round(stage["peak_rss_mb"]),
+                    "peak_traced_mb": _round(stage["peak_traced_mb"]),
+                }
+            items = {item: dict(spans) for item, spans in self.items.items()}
+
+        children_peak = _max(
+            self.children_peak_rss_mb,
+            peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        )
+        report = {
+            "command": command,
+            "wall_seconds": round(time.perf_counter() - self.started, 6),
+            "peak_rss_mb": _round(_max(self.peak_rss_mb, peak_rss_mb())),
+            "children_peak_rss_mb": _round(children_peak),
+            "stages": stages,
+            "items": items,
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                    tracemalloc.Filter(
+                        False, "<frozen importlib._bootstrap_external>"
+                    ),
+                ]
+            )
+            top = snapshot.statistics("lineno")
+            report["traced_memory"] = {
+                "current_mb": _round(current / 2**20),
+                "peak_mb": _round(peak / 2**20),
+                "top_allocations": [
+                    {
+                        "location": str(stat.traceback),
+                        "size_mb": _round(stat.size / 2**20),
+                        "count": stat.count,
+                    }
+                    for stat in top[:TOP_ALLOCATIONS]
+                ],
+            }
+        return report
+
+    def write_report(self, file_path, command=None):
+        """
+        Write the report as JSON to file_path.
+        """
+        report = self.report(command)
+        report_dir = path.dirname(file_path)
+        if report_dir:
+            makedirs(report_dir, exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+def measure(stage, item, func, *args):
+    """
+    Call func(*args) and return its result with its Span. Submitted to a
+    process pool in place of func, the span travels back with the result;
+    pass it to metrics.collect in the parent.
+    """
+    reset = reset_peak_rss()
+    start_rss, _ = rss_mb()
+    start = time.perf_counter()
+    with log_context(item):
+        value = func(*args)
+    return value, Span(
+        stage,
+        item,
+        seconds=time.perf_counter() - start,
+        peak_rss_mb=span_peak_rss_mb(reset, start_rss),
+    )
+
+
+def _rate(nbytes, seconds):
+    return round(nbytes / seconds, 1) if nbytes and seconds > 0 else None
+
+
+def _kb_to_mb(value):
+    # /proc/self/status values look like "  123456 kB".
+    return int(value.split()[0]) / 1024 if value else None
+
+
+def _max(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+metrics = Metrics()
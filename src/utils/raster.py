@@ -1,54 +1,233 @@
+import json
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter
 
+import numpy as np
 import rasterio
+from affine import Affine
 from osgeo import gdal
-from shapely.geometry import Polygon, mapping
+from rasterio import features
+from shapely import get_num_coordinates
+from shapely.geometry import Polygon, mapping, shape
+from shapely.ops import unary_union
 
+from utils.cog_profiles import COG_PROFILES
+from utils.logging_config import logger
+from utils.metrics import metrics
+from utils.reproject import bbox_to_wgs84, geometry_to_wgs84
 
-def get_tif_metadata(file_name):
+TILED_INTERMEDIATE_PIXELS = 100_000_000
+FOOTPRINT_SIZE = 1024
+FOOTPRINT_MAX_VERTICES = 500
+STATS_MODES = ("approx", "exact")
+APPROX_STATS_SIZE = 1024
+HISTOGRAM_BUCKETS = 256
+
+
+@dataclass(frozen=True)
+class RasterMetadata:
+    """
+    Metadata of a raster read from a single open of the dataset. bbox and
+    footprint are in WGS84; native_bbox is in the raster CRS.
+    """
+
+    bbox: list[float]
+    native_bbox: list[float]
+    footprint: dict
+    crs: int | str | None
+    epsg: int | None
+    resolution: float
+    dtype: str
+    nodata: float | None
+    count: int
+    width: int
+    height: int
+    block_shapes: list[tuple[int, int]]
+
+
+def read_metadata(file_name, footprint_mode="bbox"):
     """
-    Extract TIF metadata such as bbox, footprint, crs, pixel_size_x and dtype
+    Extract TIF metadata such as bbox, footprint, crs, EPSG, pixel_size_x,
+    dtype, nodata, band count and block layout, opening the file only once.
+    The footprint is the bounding rectangle or, with footprint_mode 'data',
+    the outline of the valid data (see data_footprint). Both bbox and
+    footprint are reprojected to WGS84, as STAC requires.
     """
     with rasterio.open(file_name) as r:
         bounds = r.bounds
-        bbox = [bounds.left, bounds.bottom, bounds.right, bounds.top]
-        footprint = Polygon(
-            [
-                [bounds.left, bounds.bottom],
-                [bounds.left, bounds.top],
-                [bounds.right, bounds.top],
-                [bounds.right, bounds.bottom],
-            ]
+        native_bbox = [bounds.left, bounds.bottom, bounds.right, bounds.top]
+        footprint = mapping(
+            Polygon(
+                [
+                    [bounds.left, bounds.bottom],
+                    [bounds.left, bounds.top],
+                    [bounds.right, bounds.top],
+                    [bounds.right, bounds.bottom],
+                ]
+            )
         )
+        if footprint_mode == "data":
+            footprint = data_footprint(r) or footprint
 
-        if r.meta["crs"].to_epsg() is None:
-            crs = r.meta["crs"].to_string()
+        epsg = r.crs.to_epsg() if r.crs else None
+        if epsg is None and r.crs:
+            crs = r.crs.to_string()
         else:
-            crs = r.meta["crs"].to_epsg()
+            crs = epsg
+
+        if crs is None:
+            logger.warning(f"{file_name} has no CRS, bbox is not reprojected")
+            bbox = native_bbox
+        else:
+            bbox = bbox_to_wgs84(native_bbox, crs)
+            footprint = geometry_to_wgs84(footprint, crs)
 
         pixel_size_x, _ = r.res
-        return (
-            bbox,
-            mapping(footprint),
-            crs,
-            pixel_size_x,
-            r.meta["dtype"],
+        return RasterMetadata(
+            bbox=bbox,
+            native_bbox=native_bbox,
+            footprint=footprint,
+            crs=crs,
+            epsg=epsg,
+            resolution=pixel_size_x,
+            dtype=r.dtypes[0],
+            nodata=r.nodata,
+            count=r.count,
+            width=r.width,
+            height=r.height,
+            block_shapes=list(r.block_shapes),
+        )
+
+
+def scan_metadata(file_names, workers, cache=None, footprint_mode="bbox"):
+    """
+    Read the metadata of several rasters with a pool of threads (GDAL releases
+    the GIL while reading headers). Results keep the order of file_names.
+    If a MetadataCache is given, unchanged files are served from it; entries
+    are kept apart per footprint_mode.
+    """
+    variant = (
+        None if footprint_mode == "bbox" else f"footprint={footprint_mode}"
+    )
+
+    def timed_read(file_name):
+        start = perf_counter()
+        metadata = cache.get(file_name, variant) if cache else None
+        if metadata is not None:
+            source = "cache"
+        else:
+            with metrics.span("metadata", os.path.basename(file_name)):
+                metadata = read_metadata(file_name, footprint_mode)
+            source = "file"
+            if cache:
+                cache.put(file_name, metadata, variant)
+        logger.info(
+            f"Retrieved metadata from {source}: {file_name} "
+            f"({perf_counter() - start:.3f} s)"
         )
+        return metadata
 
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(timed_read, file_names))
 
-def tif_to_cog(input_file, input_dir, output_dir):
+
+def data_footprint(dataset):
     """
-    Convert layer from TIF to COG format
+    Get the outline of the valid data of a raster as a GeoJSON geometry in
+    the raster CRS, or None if it has no valid pixels. The mask is read decimated to
+    at most FOOTPRINT_SIZE pixels per side (from the overviews when there
+    are), vectorized, and simplified until it has at most
+    FOOTPRINT_MAX_VERTICES vertices, so the full resolution is never read.
+    """
+    scale = max(
+        dataset.width / FOOTPRINT_SIZE, dataset.height / FOOTPRINT_SIZE, 1
+    )
+    height = max(int(dataset.height / scale), 1)
+    width = max(int(dataset.width / scale), 1)
+
+    mask = dataset.dataset_mask(out_shape=(height, width))
+    transform = dataset.transform * Affine.scale(
+        dataset.width / width, dataset.height / height
+    )
+    polygons = [
+        shape(geometry)
+        for geometry, _ in features.shapes(
+            mask, mask=mask > 0, transform=transform
+        )
+    ]
+    if not polygons:
+        return None
+
+    outline = unary_union(polygons)
+    tolerance = max(abs(transform.a), abs(transform.e))
+    simplified = outline.simplify(tolerance)
+    while get_num_coordinates(simplified) > FOOTPRINT_MAX_VERTICES:
+        tolerance *= 2
+        simplified = outline.simplify(tolerance)
+
+    return mapping(simplified)
+
+
+def tif_to_cog(
+    input_file,
+    input_dir,
+    output_dir,
+    memory_mb=None,
+    num_threads=None,
+    profile="default",
+    stats=None,
+):
+    """
+    Convert layer from TIF to COG format. Inputs that already are valid
+    COGs with the compression and predictor of the profile are hard-linked
+    (or copied) to the output instead.
+    profile names the compression, predictor and overview resampling set
+    from COG_PROFILES. If stats is 'approx' or 'exact', the band statistics
+    of the COG are computed right away, in the same worker (see
+    cog_statistics).
+    memory_mb caps the GDAL block cache and num_threads sets the threads used
+    for compression and overview building. GDAL reads and writes the raster
+    block by block, so memory stays within the cache; large striped inputs
+    are first rewritten as a tiled intermediate so that those blocks are
+    bounded windows instead of full-width strips.
     """
     cog_options = [
-        "COMPRESS=DEFLATE",
         "BLOCKSIZE=512",
         "OVERVIEWS=IGNORE_EXISTING",
+        *COG_PROFILES[profile],
     ]
+    config_options = {}
 
-    layer = gdal.Open("{}/{}".format(input_dir, input_file), gdal.GA_ReadOnly)
+    if memory_mb:
+        gdal.SetCacheMax(memory_mb * 1024 * 1024)
+    if num_threads:
+        cog_options.append(f"NUM_THREADS={num_threads}")
+        config_options["GDAL_NUM_THREADS"] = str(num_threads)
+
+    input_path = "{}/{}".format(input_dir, input_file)
     output_path = "{}/{}".format(output_dir, input_file)
 
+    if is_cloud_optimized(input_path):
+        mismatch = profile_mismatch(input_path, profile)
+        if mismatch is None:
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            link_or_copy(input_path, output_path)
+            logger.info(f"{input_file} is already a COG, reused as is")
+            if stats:
+                cog_statistics(output_path, stats)
+            return output_path
+        logger.info(
+            f"{input_file} is already a COG but {mismatch} the {profile} "
+            "profile, converting it"
+        )
+
+    layer = gdal.Open(input_path, gdal.GA_ReadOnly)
+    intermediate_path = None
+
     if not layer:
         raise RuntimeError("Error al leer el archivo: {}".format(input_file))
 
@@ -56,20 +235,411 @@ def tif_to_cog(input_file, input_dir, output_dir):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        gdal.Translate(
-            output_path, layer, format="COG", creationOptions=cog_options
-        )
+        with gdal.config_options(config_options):
+            if needs_tiled_intermediate(layer):
+                intermediate_path = f"{output_path}.tiled.tmp"
+                gdal.Translate(
+                    intermediate_path,
+                    layer,
+                    format="GTiff",
+                    creationOptions=[
+                        "TILED=YES",
+                        "BLOCKXSIZE=512",
+                        "BLOCKYSIZE=512",
+                        "COMPRESS=LZW",
+                        "BIGTIFF=IF_SAFER",
+                        f"NUM_THREADS={num_threads or 'ALL_CPUS'}",
+                    ],
+                )
+                layer = gdal.Open(intermediate_path, gdal.GA_ReadOnly)
+
+            gdal.Translate(
+                output_path, layer, format="COG", creationOptions=cog_options
+            )
 
         # This check exists because if the conversion fails no error is shown.
         if not os.path.exists(output_path):
             raise RuntimeError(
                 "No fue posible convertir el archivo a formato COG."
             )
-
-        return output_path
     except Exception as e:
         raise RuntimeError(
             "Error al convertir el archivo: {}. Detalle: {}".format(
                 input_file, e
             )
         )
+    finally:
+        layer = None
+        if intermediate_path and os.path.exists(intermediate_path):
+            os.remove(intermediate_path)
+
+    if stats:
+        cog_statistics(output_path, stats)
+    return output_path
+
+
+def needs_tiled_intermediate(layer):
+    """
+    Check if a layer is stored in full-width strips and is large enough
+    (TILED_INTERMEDIATE_PIXELS) for the COG writer to thrash the block cache
+    when reading it.
+    """
+    block_width, _ = layer.GetRasterBand(1).GetBlockSize()
+    return (
+        block_width == layer.RasterXSize
+        and layer.RasterXSize * layer.RasterYSize >= TILED_INTERMEDIATE_PIXELS
+    )
+
+
+def is_cloud_optimized(file_name):
+    """
+    Check, reading only the file header, if a TIF is a valid COG: the checks
+    of GDAL's validate_cloud_optimized_geotiff on tiling, overviews and the
+    order of the IFDs (all before the image data), and no external
+    overviews (a .ovr sidecar, which would not be copied with the file).
+    """
+    layer = gdal.Open(file_name, gdal.GA_ReadOnly)
+    if layer is None or layer.GetDriver().ShortName != "GTiff":
+        return False
+
+    if any(
+        name.lower().endswith(".ovr") for name in layer.GetFileList() or []
+    ):
+        return False
+
+    if layer.GetMetadataItem("LAYOUT", "IMAGE_STRUCTURE") == "COG":
+        return True
+
+    band = layer.GetRasterBand(1)
+    levels = [band] + [
+        band.GetOverview(i) for i in range(band.GetOverviewCount())
+    ]
+
+    if max(layer.RasterXSize, layer.RasterYSize) > 512 and len(levels) == 1:
+        return False
+
+    for level in levels:
+        block_width, _ = level.GetBlockSize()
+        if block_width == level.XSize and level.XSize > 512:
+            return False
+
+    try:
+        ifd_offsets = [
+            int(level.GetMetadataItem("IFD_OFFSET", "TIFF"))
+            for level in levels
+        ]
+        data_offset = int(band.GetMetadataItem("BLOCK_OFFSET_0_0", "TIFF"))
+    except (TypeError, ValueError):
+        return False
+
+    return ifd_offsets == sorted(ifd_offsets) and ifd_offsets[-1] < data_offset
+
+
+def profile_mismatch(file_name, profile):
+    """
+    Compare the compression and predictor of a TIF with the ones of a COG
+    profile. Return None if they match, or why they do not.
+    """
+    options = dict(option.split("=", 1) for option in COG_PROFILES[profile])
+    expected_compression = options.get("COMPRESS", "NONE")
+    expected_predictor = options.get("PREDICTOR", "NO") != "NO"
+
+    layer = gdal.Open(file_name, gdal.GA_ReadOnly)
+    structure = layer.GetMetadata("IMAGE_STRUCTURE") or {}
+    compression = structure.get("COMPRESSION", "NONE")
+    predictor = structure.get("PREDICTOR", "1") != "1"
+    layer = None
+
+    if compression.upper() != expected_compression:
+        return f"its {compression} compression does not match"
+    if predictor != expected_predictor:
+        return "its predictor does not match"
+    return None
+
+
+def link_or_copy(source, target):
+    """
+    Hard-link source to target, or copy it if linking is not possible
+    (e.g. different file systems).
+    """
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def statistics_path(file_name):
+    """Path of the sidecar file where the statistics of a COG are kept."""
+    return f"{file_name}.stats.json"
+
+
+def cog_statistics(file_name, mode="approx"):
+    """
+    Get the statistics (minimum, maximum, mean, stddev, valid_percent) and
+    histogram of each band of a COG, as dicts for raster:bands. They are
+    kept in a sidecar JSON file and only computed again if the COG changed
+    or they were computed in another mode.
+    'approx' reads a decimated copy of at most APPROX_STATS_SIZE pixels per
+    side (served from the overviews); 'exact' reads every block once (see
+    _exact_statistics).
+    """
+    if mode not in STATS_MODES:
+        raise ValueError(f"Unknown statistics mode: {mode}")
+
+    sidecar = statistics_path(file_name)
+    mtime_ns = os.stat(file_name).st_mtime_ns
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["mode"] == mode and cached["mtime_ns"] == mtime_ns:
+            return cached["bands"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    start = perf_counter()
+    with rasterio.open(file_name) as r:
+        if mode == "exact":
+            bands = _exact_statistics(r)
+        else:
+            scale = max(r.width, r.height) / APPROX_STATS_SIZE
+            if scale > 1:
+                out_shape = (
+                    r.count,
+                    max(int(r.height / scale), 1),
+                    max(int(r.width / scale), 1),
+                )
+            else:
+                out_shape = None
+            data = r.read(masked=True, out_shape=out_shape)
+            bands = [_band_statistics(band) for band in data]
+
+    tmp_path = f"{sidecar}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"mode": mode, "mtime_ns": mtime_ns, "bands": bands}, f)
+    os.replace(tmp_path, sidecar)
+
+    logger.info(
+        f"Computed {mode} statistics of {os.path.basename(file_name)} "
+        f"in {perf_counter() - start:.2f}s"
+    )
+    return bands
+
+
+def _valid_values(block):
+    """Flatten the valid (unmasked, finite) values of a masked block."""
+    values = block.compressed()
+    if values.dtype.kind == "f":
+        values = values[np.isfinite(values)]
+    return values
+
+
+def _band_statistics(band):
+    """Statistics and histogram of a band read in a single array."""
+    values = _valid_values(band)
+    if values.size == 0:
+        return {"statistics": {"valid_percent": 0.0}}
+
+    minimum, maximum = float(values.min()), float(values.max())
+    buckets, _ = np.histogram(
+        values, bins=HISTOGRAM_BUCKETS, range=(minimum, maximum)
+    )
+    return {
+        "statistics": {
+            "minimum": minimum,
+            "maximum": maximum,
+            "mean": float(values.mean(dtype="float64")),
+            "stddev": float(values.std(dtype="float64")),
+            "valid_percent": 100.0 * values.size / band.size,
+        },
+        "histogram": {
+            "count": HISTOGRAM_BUCKETS,
+            "min": minimum,
+            "max": maximum,
+            "buckets": buckets.tolist(),
+        },
+    }
+
+
+def _exact_statistics(dataset):
+    """
+    Statistics and histograms of every band, reduced in a single read of the
+    blocks, so that only one block is in memory at a time.
+    """
+    accumulators = [
+        (
+            _ValueCounts(dtype)
+            if np.dtype(dtype).kind in "iu" and np.dtype(dtype).itemsize <= 2
+            else _RunningStatistics()
+        )
+        for dtype in dataset.dtypes
+    ]
+    for _, window in dataset.block_windows(1):
+        block = dataset.read(window=window, masked=True)
+        for b, accumulator in enumerate(accumulators):
+            values = _valid_values(block[b])
+            if values.size:
+                accumulator.add(values)
+
+    pixels = dataset.width * dataset.height
+    return [accumulator.band(pixels) for accumulator in accumulators]
+
+
+def _band_entry(valid, pixels, minimum, maximum, mean, stddev, histogram):
+    """raster:bands entry of a band; histogram is (min, max, buckets)."""
+    if not valid:
+        return {"statistics": {"valid_percent": 0.0}}
+    histogram_min, histogram_max, buckets = histogram
+    return {
+        "statistics": {
+            "minimum": float(minimum),
+            "maximum": float(maximum),
+            "mean": float(mean),
+            "stddev": float(stddev),
+            "valid_percent": float(100.0 * valid / pixels),
+        },
+        "histogram": {
+            "count": HISTOGRAM_BUCKETS,
+            "min": float(histogram_min),
+            "max": float(histogram_max),
+            "buckets": [int(bucket) for bucket in buckets],
+        },
+    }
+
+
+class _ValueCounts:
+    """
+    Count of each value of an 8 or 16 bit integer band. The statistics and
+    the histogram between the band minimum and maximum are derived exactly
+    from the counts once every block has been added.
+    """
+
+    def __init__(self, dtype):
+        info = np.iinfo(dtype)
+        self.offset = info.min
+        self.counts = np.zeros(info.max - info.min + 1, dtype="int64")
+
+    def add(self, values):
+        self.counts += np.bincount(
+            values.astype("int64") - self.offset, minlength=self.counts.size
+        )
+
+    def band(self, pixels):
+        present = np.flatnonzero(self.counts)
+        if present.size == 0:
+            return _band_entry(0, pixels, None, None, None, None, None)
+
+        values = (present + self.offset).astype("float64")
+        counts = self.counts[present]
+        valid = int(counts.sum())
+        mean = (values * counts).sum() / valid
+        stddev = np.sqrt((counts * (values - mean) ** 2).sum() / valid)
+        minimum, maximum = values[0], values[-1]
+        buckets, _ = np.histogram(
+            values,
+            bins=HISTOGRAM_BUCKETS,
+            range=(minimum, maximum),
+            weights=counts,
+        )
+        return _band_entry(
+            valid,
+            pixels,
+            minimum,
+            maximum,
+            mean,
+            stddev,
+            (minimum, maximum, buckets),
+        )
+
+
+class _RunningStatistics:
+    """
+    Statistics of a band of any type, merged block by block: means and
+    variances with Chan's parallel algorithm, and a histogram of fixed-width
+    buckets whose range starts at the one of the first block and doubles, by
+    merging pairs of buckets, whenever a block falls outside of it. Its
+    bounds thus cover the band range without being exactly its minimum and
+    maximum.
+    """
+
+    def __init__(self):
+        self.valid = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.low = None
+        self.width = 0.0
+        self.buckets = np.zeros(HISTOGRAM_BUCKETS, dtype="int64")
+
+    def add(self, values):
+        values = values.astype("float64")
+        block_mean = values.mean()
+        block_m2 = ((values - block_mean) ** 2).sum()
+        total = self.valid + values.size
+        delta = block_mean - self.mean
+        self.mean += delta * values.size / total
+        self.m2 += block_m2 + delta**2 * self.valid * values.size / total
+        self.valid = total
+
+        low, high = values.min(), values.max()
+        self.minimum = min(self.minimum, low)
+        self.maximum = max(self.maximum, high)
+        self._cover(low, high)
+
+        if self.width == 0:
+            # Every value so far is self.low.
+            self.buckets[HISTOGRAM_BUCKETS // 2] += values.size
+            return
+        buckets, _ = np.histogram(
+            values, bins=HISTOGRAM_BUCKETS, range=(self.low, self._high())
+        )
+        self.buckets += buckets
+
+    def _high(self):
+        return self.low + self.width * HISTOGRAM_BUCKETS
+
+    def _cover(self, low, high):
+        """Grow the histogram range until it covers [low, high]."""
+        if self.low is None:
+            self.low, self.width = low, (high - low) / HISTOGRAM_BUCKETS
+            return
+
+        if self.width == 0:
+            if low == high == self.low:
+                return
+            count = self.buckets.sum()
+            value = self.low
+            self.buckets[:] = 0
+            self.low = min(low, value)
+            self.width = (max(high, value) - self.low) / HISTOGRAM_BUCKETS
+            index = int((value - self.low) / self.width)
+            self.buckets[min(index, HISTOGRAM_BUCKETS - 1)] = count
+            return
+
+        half = np.zeros(HISTOGRAM_BUCKETS // 2, dtype="int64")
+        while low < self.low:
+            merged = self.buckets.reshape(-1, 2).sum(axis=1)
+            self.buckets = np.concatenate([half, merged])
+            self.low -= self.width * HISTOGRAM_BUCKETS
+            self.width *= 2
+        while high > self._high():
+            merged = self.buckets.reshape(-1, 2).sum(axis=1)
+            self.buckets = np.concatenate([merged, half])
+            self.width *= 2
+
+    def band(self, pixels):
+        if self.width == 0:
+            histogram = (self.minimum, self.maximum, self.buckets)
+        else:
+            histogram = (self.low, self._high(), self.buckets)
+        return _band_entry(
+            self.valid,
+            pixels,
+            self.minimum,
+            self.maximum,
+            self.mean,
+            np.sqrt(self.m2 / self.valid) if self.valid else None,
+            histogram,
+        )
@@ -0,0 +1,71 @@
+import threading
+
+import numpy as np
+import shapely
+from osgeo import osr
+from shapely.geometry import mapping, shape
+
+WGS84_EPSG = 4326
+DENSIFY_POINTS = 21
+
+_local = threading.local()
+
+
+def get_transformer(source_crs):
+    """
+    Get a transformation from source_crs (EPSG code or WKT) to WGS84 in
+    longitude/latitude order. Transformations are not thread-safe, so each
+    thread builds and caches its own, once per source CRS.
+    """
+    transformers = getattr(_local, "transformers", None)
+    if transformers is None:
+        transformers = _local.transformers = {}
+
+    if source_crs not in transformers:
+        source = osr.SpatialReference()
+        if isinstance(source_crs, int):
+            source.ImportFromEPSG(source_crs)
+        else:
+            source.SetFromUserInput(source_crs)
+        target = osr.SpatialReference()
+        target.ImportFromEPSG(WGS84_EPSG)
+        for srs in (source, target):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transformers[source_crs] = osr.CoordinateTransformation(source, target)
+    return transformers[source_crs]
+
+
+def bbox_to_wgs84(bbox, source_crs):
+    """
+    Reproject a [minx, miny, maxx, maxy] bbox to WGS84, densifying its edges
+    so that the result covers their curved shape in the new CRS.
+    """
+    if source_crs == WGS84_EPSG:
+        return list(bbox)
+    return list(
+        get_transformer(source_crs).TransformBounds(*bbox, DENSIFY_POINTS)
+    )
+
+
+def geometry_to_wgs84(geometry, source_crs):
+    """
+    Reproject a GeoJSON geometry to WGS84. Edges longer than 1/DENSIFY_POINTS
+    of the geometry extent are split first, so straight edges in the source
+    CRS follow their true path.
+    """
+    if source_crs == WGS84_EPSG:
+        return geometry
+
+    geom = shape(geometry)
+    minx, miny, maxx, maxy = geom.bounds
+    max_length = max(maxx - minx, maxy - miny) / DENSIFY_POINTS
+    if max_length > 0:
+        geom = shapely.segmentize(geom, max_length)
+
+    transformer = get_transformer(source_crs)
+
+    def transform(coords):
+        points = transformer.TransformPoints(coords.tolist())
+        return np.array(points)[:, :2]
+
+    return mapping(shapely.transform(geom, transform))
@@ -0,0 +1,71 @@
+import random
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import get_settings
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = Retry.DEFAULT_ALLOWED_METHODS
+
+
+def is_retryable(method, status_code):
+    """
+    Whether a response can be retried. A 429 is refused before the request
+    is processed, so it is retried for any method; a 5xx only for idempotent
+    methods, since a POST may have been committed (creating the item twice or
+    getting a 409 on the retry).
+    """
+    return status_code in RETRY_STATUS_CODES and (
+        status_code == 429 or method.upper() in IDEMPOTENT_METHODS
+    )
+
+
+class JitterRetry(Retry):
+    """
+    Retry policy that adds random jitter to the exponential backoff, so
+    parallel workers hitting a throttled server do not retry in lockstep.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # Read errors and 5xx are only retried for idempotent methods
+        # (allowed_methods); 429 for every method, see is_retryable.
+        if status_code == 429:
+            method = "GET"
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, backoff)
+
+
+@lru_cache
+def get_session():
+    """
+    Shared HTTP session with connection pooling, keep-alive and retries with
+    backoff for 429 and 5xx responses (see is_retryable). POST requests are
+    only retried on 429 and on connection errors, before anything was sent.
+    """
+    settings = get_settings()
+
+    retry = JitterRetry(
+        total=settings.http_retries,
+        backoff_factor=settings.http_backoff,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=IDEMPOTENT_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.http_pool_size,
+        pool_maxsize=settings.http_pool_size,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -1,8 +1,11 @@
 from enum import Enum
+from functools import lru_cache
 from json import load
 from os import listdir, path
 
-from jsonschema import FormatError, validate
+from jsonschema import FormatError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 
 class CollectionDataType(Enum):
@@ -21,14 +24,26 @@ def validate_input_folder(folder):
         )
 
 
-def validate_format(data):
+@lru_cache
+def get_format_validator():
     """
-    Check if the collection.json file has the defined format
+    Load spec/collection.json and build its validator, once per process.
     """
     with open("spec/collection.json", "r") as f:
         schema = load(f)
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def validate_format(data):
+    """
+    Check if the collection.json file has the defined format
+    """
     try:
-        validate(instance=data, schema=schema)
+        error = best_match(get_format_validator().iter_errors(data))
+        if error is not None:
+            raise error
 
         if "metadata" in data:
             if "projection" in data["metadata"]:
@@ -60,6 +75,16 @@ def validate_format(data):
 
             data_type_enum = CollectionDataType(data_type)
 
+            if "cog_profile" in data["metadata"]:
+                from utils.cog_profiles import AUTO_PROFILE, COG_PROFILES
+
+                profiles = [AUTO_PROFILE, *COG_PROFILES]
+                if data["metadata"]["cog_profile"] not in profiles:
+                    raise FormatError(
+                        "Error en el perfil COG de la colección 'metadata.cog_profile': "
+                        f"El elemento debe tener uno de estos valores: {profiles}"
+                    )
+
             if "properties" in data["metadata"]:
                 if data_type_enum == CollectionDataType.CLASSIFIED:
                     properties = {
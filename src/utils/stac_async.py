@@ -0,0 +1,94 @@
+import asyncio
+import random
+from dataclasses import dataclass
+
+import httpx
+
+from config import get_settings
+from utils.auth import get_token, invalidate_token
+from utils.logging_config import logger
+from utils.session import is_retryable
+from utils.stac_rest import AUTH_REJECTED
+
+
+@dataclass
+class ItemResult:
+    """Outcome of registering a single item."""
+
+    item_id: str
+    status_code: int | None = None
+    error: str | None = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def register_items(url: str, items: list[dict], concurrency: int):
+    """
+    Post (or put, on conflict) items to URL with at most `concurrency`
+    requests in flight. Return an ItemResult per item, in input order.
+    """
+    return asyncio.run(_register_items(url, items, concurrency))
+
+
+async def _register_items(url, items, concurrency):
+    settings = get_settings()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(client, method, item):
+        # The token manager renews the token shortly before it expires, once
+        # for all requests; a refresh runs in a thread to keep the loop free.
+        token = await asyncio.to_thread(get_token)
+        for attempt in range(settings.http_retries + 1):
+            response = await client.request(
+                method,
+                url,
+                json=item,
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            if (
+                not is_retryable(method, response.status_code)
+                or attempt == settings.http_retries
+            ):
+                return response
+            backoff = settings.http_backoff * 2**attempt
+            await asyncio.sleep(backoff + random.uniform(0, backoff))
+
+    async def register(client, item):
+        async with semaphore:
+            try:
+                response = await send(client, "POST", item)
+
+                if response.status_code in AUTH_REJECTED:
+                    # Drop the rejected token and try once with a new one.
+                    auth = response.request.headers["Authorization"]
+                    invalidate_token(auth.removeprefix("Bearer "))
+                    response = await send(client, "POST", item)
+
+                if response.status_code == 409:
+                    response = await send(client, "PUT", item)
+
+                response.raise_for_status()
+                return ItemResult(item["id"], response.status_code)
+            except Exception as e:
+                status_code = getattr(
+                    getattr(e, "response", None), "status_code", None
+                )
+                return ItemResult(item["id"], status_code, str(e))
+
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    # The transport retries failed connections only, which is safe for POST.
+    transport = httpx.AsyncHTTPTransport(
+        limits=limits, retries=settings.http_retries
+    )
+    async with httpx.AsyncClient(transport=transport, timeout=60) as client:
+        results = await asyncio.gather(
+            *(register(client, item) for item in items)
+        )
+
+    registered = sum(result.ok for result in results)
+    logger.info(f"Registered {registered} of {len(results)} items")
+    return results
@@ -19,3 +19,15 @@ def map_dtype_to_pystac_datatype(dtype_str: str) -> DataType | None:
     if d in ("float64", "double"):
         return DataType.FLOAT64
     return None
+
+
+BULK_TRANSACTION_MARKERS = ("bulk-transactions", "bulk_transactions")
+
+
+def supports_bulk_items(conformance: list[str]) -> bool:
+    """Check if the conformance classes advertise the bulk transactions extension."""
+    return any(
+        marker in conformance_class
+        for conformance_class in conformance
+        for marker in BULK_TRANSACTION_MARKERS
+    )
@@ -1,15 +1,41 @@
+from urllib import parse
+
 import requests
 
 from config import get_settings
-from utils.auth import authenticate
+from utils.auth import get_token, invalidate_token
+from utils.session import get_session
+
+# Statuses of a request whose token the server did not accept.
+AUTH_REJECTED = (401, 403)
 
 
 def get_headers():
     """
-    Generate Authorization header dynamically using the current token.
+    Generate Authorization header dynamically using the current token,
+    renewed beforehand if it is about to expire.
     """
-    settings = get_settings()
-    return {"Authorization": f"Bearer {settings.token}"}
+    return {"Authorization": f"Bearer {get_token()}"}
+
+
+def send_authorized(method: str, url: str, **kwargs):
+    """
+    Send a request with the Authorization header. If the server rejects
+    the token (401 or 403), it is dropped, also from the disk cache, and the
+    request is sent once more with a new one. Return the response and the
+    headers it was sent with.
+    """
+    headers = get_headers()
+    response = get_session().request(method, url, headers=headers, **kwargs)
+
+    if response.status_code in AUTH_REJECTED:
+        invalidate_token(headers["Authorization"].removeprefix("Bearer "))
+        headers = get_headers()
+        response = get_session().request(
+            method, url, headers=headers, **kwargs
+        )
+
+    return response, headers
 
 
 def post_or_put(url: str, data: dict):
@@ -18,20 +44,10 @@ def post_or_put(url: str, data: dict):
     """
 
     try:
-        headers = get_headers()
-        response = requests.post(url, json=data, headers=headers)
-
-        if response.status_code == 401:
-            if (
-                response.json().get("code") == "UnauthorizedError"
-                and "expired" in response.json().get("description", "").lower()
-            ):
-                authenticate()
-                headers = get_headers()
-                response = requests.post(url, json=data, headers=headers)
+        response, headers = send_authorized("POST", url, json=data)
 
         if response.status_code == 409:
-            response = requests.put(url, json=data, headers=headers)
+            response = get_session().put(url, json=data, headers=headers)
 
         response.raise_for_status()
 
@@ -40,20 +56,87 @@ def post_or_put(url: str, data: dict):
         raise e
 
 
-def get(url: str):
+def post(url: str, data: dict):
+    """
+    Post data to URL, without falling back to put on conflict
+    """
+    response, _ = send_authorized("POST", url, json=data)
+    response.raise_for_status()
+    return response
+
+
+def get_conformance(stac_url: str):
+    """
+    Get the conformance classes of the STAC server, from /conformance or,
+    if that is not available, from the landing page. Return an empty list
+    if neither can be read.
+    """
+    for url in (parse.urljoin(stac_url, "/conformance"), stac_url):
+        try:
+            response = get(url)
+            conforms_to = response.json().get("conformsTo")
+        except (requests.exceptions.RequestException, ValueError):
+            continue
+        if conforms_to:
+            return conforms_to
+    return []
+
+
+def get(url: str, params: dict | None = None):
     """
     Get request
     """
-    response = requests.get(url)
+    response = get_session().get(url, params=params)
     response.raise_for_status()
     return response
 
 
+def iter_items(items_url: str, page_size: int | None = None):
+    """
+    Iterate over the items of an items endpoint page by page, following the
+    'next' links, so the whole collection is never held in memory.
+    """
+    page_size = page_size or get_settings().stac_page_size
+    response = get(items_url, params={"limit": page_size})
+    visited = {(response.url, None)}
+
+    while True:
+        page = response.json()
+        yield from page.get("features", [])
+
+        next_link = next(
+            (
+                link
+                for link in page.get("links", [])
+                if link.get("rel") == "next"
+            ),
+            None,
+        )
+        if next_link is None:
+            return
+
+        body = next_link.get("body")
+        page_key = (next_link["href"], str(body) if body else None)
+        if page_key in visited:
+            return
+
+        if next_link.get("method", "GET").upper() == "POST":
+            response = get_session().post(
+                next_link["href"],
+                json=body or {},
+                headers=next_link.get("headers"),
+            )
+            response.raise_for_status()
+        else:
+            response = get(next_link["href"])
+        visited.add(page_key)
+
+
 def check_resource(url: str):
     """
     Check if an URL for a resource exists. e.g. items, collections, catalogues
     """
-    response = requests.get(url)
+    response = get_session().get(url)
     if response.status_code == 200:
         success = True
     elif response.status_code == 404:
@@ -67,27 +150,11 @@ def delete(url):
     """
     Delete request
     """
-    headers = get_headers()
-    response = requests.delete(url, headers=headers)
-    if response.status_code == 401:
-        if (
-            response.json().get("code") == "UnauthorizedError"
-            and "expired" in response.json().get("description", "").lower()
-        ):
-            authenticate()
-            headers = get_headers()
-            response = requests.delete(url, headers=headers)
-            if response.status_code == 200:
-                success = True
-            elif response.status_code == 404:
-                success = False
-            else:
-                response.raise_for_status()
-    elif response.status_code == 200:
+    response, _ = send_authorized("DELETE", url)
+    if response.status_code == 200:
         success = True
     elif response.status_code == 404:
         success = False
-
     else:
         response.raise_for_status()
     return success
@@ -0,0 +1,196 @@
+import hashlib
+import json
+from functools import lru_cache
+from os import path
+
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import best_match
+from pystac.errors import STACValidationError
+from referencing import Registry, Resource
+from referencing.jsonschema import DRAFT7
+
+from utils.logging_config import logger
+from utils.metrics import metrics
+
+SCHEMAS_DIR = "spec/schemas"
+SOURCES_FILE = f"{SCHEMAS_DIR}/sources.json"
+ITEM_SCHEMA = (
+    "https://schemas.stacspec.org/v1.0.0/item-spec/json-schema/item.json"
+)
+COLLECTION_SCHEMA = (
+    "https://schemas.stacspec.org/v1.0.0/collection-spec/json-schema/"
+    "collection.json"
+)
+PROJECTION_SCHEMA = (
+    "https://stac-extensions.github.io/projection/v1.0.0/schema.json"
+)
+RASTER_SCHEMA = "https://stac-extensions.github.io/raster/v1.1.0/schema.json"
+# Schemas of the objects and extensions this tool writes: validation cannot
+# go on without them.
+REQUIRED_SCHEMAS = (
+    ITEM_SCHEMA,
+    COLLECTION_SCHEMA,
+    PROJECTION_SCHEMA,
+    RASTER_SCHEMA,
+)
+
+
+@lru_cache
+def get_registry():
+    """
+    Load the local bundle of STAC schemas (SCHEMAS_DIR) listed in
+    SOURCES_FILE into a registry keyed by their $id, so references are
+    resolved without network access. Every file must match the sha256 of
+    the upstream file recorded in SOURCES_FILE; schemas not vendored yet
+    are left out (see vendor_schemas.py).
+    """
+    with open(SOURCES_FILE, "r", encoding="utf-8") as f:
+        sources = json.load(f)
+
+    resources = []
+    for file_name, source in sources.items():
+        file_path = path.join(SCHEMAS_DIR, file_name)
+        if not path.isfile(file_path):
+            continue
+        with open(file_path, "rb") as f:
+            content = f.read()
+        if hashlib.sha256(content).hexdigest() != source["sha256"]:
+            raise RuntimeError(
+                f"Schema {file_path} does not match the upstream file "
+                f"{source['url']} recorded in {SOURCES_FILE}"
+            )
+        resource = Resource.from_contents(
+            json.loads(content), default_specification=DRAFT7
+        )
+        resources.append((resource.id().rstrip("#"), resource))
+    return Registry().with_resources(resources)
+
+
+@lru_cache
+def get_validator(schema_uri):
+    """
+    Build the validator of a bundled schema once per process. Raise an error
+    if one of the REQUIRED_SCHEMAS is not in the bundle; return None, with a
+    warning, for any other missing schema.
+    """
+    registry = get_registry()
+    try:
+        schema = registry.contents(schema_uri)
+    except LookupError:
+        if schema_uri in REQUIRED_SCHEMAS:
+            raise RuntimeError(
+                f"Schema {schema_uri} is not bundled. Run "
+                "src/vendor_schemas.py to download it."
+            )
+        logger.warning(
+            f"Schema {schema_uri} is not bundled, skipping it. Run "
+            "src/vendor_schemas.py to download it."
+        )
+        return None
+    return Draft7Validator(schema, registry=registry)
+
+
+def validate_objects(objects, core_schema):
+    """
+    Validate STAC objects (dicts) against the core schema and the schemas of
+    their stac_extensions. Return the error messages of each invalid object,
+    keyed by its id. Extensions missing from the bundle are skipped, except
+    the ones this tool writes.
+    """
+    report = {}
+    for obj in objects:
+        errors = []
+        with metrics.span("validation", obj.get("id")):
+            # Serialize first, as pystac does: tuples (e.g. the coordinates of
+            # geometries built with shapely) are only arrays once in JSON.
+            obj = json.loads(json.dumps(obj))
+            for schema_uri in [core_schema, *obj.get("stac_extensions", [])]:
+                validator = get_validator(schema_uri)
+                if validator is None:
+                    continue
+                for error in validator.iter_errors(obj):
+                    error = branch_error(error)
+                    location = "/".join(
+                        str(part) for part in error.absolute_path
+                    )
+                    errors.append(
+                        f"'{location}': {error.message} (schema {schema_uri})"
+                    )
+        if errors:
+            report[obj.get("id")] = list(dict.fromkeys(errors))
+    return report
+
+
+def branch_error(error):
+    """
+    Errors under oneOf/anyOf hold the errors of every failing branch in
+    their context. Descend into the branch meant for the object, the only
+    one that does not reject it for what it is (see rejects_kind), e.g. the
+    Feature branch of an extension schema for an item, and report its most
+    relevant error. When no single branch is meant for the object, report
+    the error itself.
+    """
+    while error.context:
+        branches = {}
+        for sub_error in error.context:
+            branch = sub_error.relative_schema_path[0]
+            branches.setdefault(branch, []).append(sub_error)
+        matching = [
+            errors
+            for errors in branches.values()
+            if not any(rejects_kind(sub_error, error) for sub_error in errors)
+        ]
+        if len(matching) != 1:
+            break
+        error = best_match(matching[0])
+    return error
+
+
+def rejects_kind(sub_error, error):
+    """
+    Check if an error of a oneOf/anyOf branch means the branch is for
+    another kind of object: a different value of its type field, a
+    different JSON type, or null where the object has a value.
+    """
+    path = list(sub_error.absolute_path)
+    if path == [*error.absolute_path, "type"]:
+        return True
+    return sub_error.validator == "type" and (
+        path == list(error.absolute_path)
+        or sub_error.validator_value == "null"
+    )
+
+
+def validate_items(stac_items):
+    """
+    Validate pystac Items in one pass and raise a single error that lists
+    every invalid item and all of its errors.
+    """
+    report = validate_objects(
+        [item.to_dict() for item in stac_items], ITEM_SCHEMA
+    )
+    raise_report(report, len(stac_items), "items")
+
+
+def validate_collection(stac_collection):
+    """
+    Validate a pystac Collection against the bundled schemas.
+    """
+    report = validate_objects([stac_collection.to_dict()], COLLECTION_SCHEMA)
+    raise_report(report, 1, "collections")
+
+
+def raise_report(report, total, kind):
+    """
+    Raise a STACValidationError listing the errors of a validation report.
+    """
+    if not report:
+        return
+    details = "\n".join(
+        f"- {obj_id}: {error}"
+        for obj_id, errors in report.items()
+        for error in errors
+    )
+    raise STACValidationError(
+        f"{len(report)} of {total} {kind} failed validation:\n{details}"
+    )
@@ -1,54 +1,184 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import path
 from urllib import parse
 
-from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient, ContentSettings
 
 from config import get_settings
+from utils.checksum import file_digest
 from utils.logging_config import logger
+from utils.metrics import metrics
+
+DELETE_BATCH_SIZE = 256
 
 
 class Storage:
 
     def __init__(self):
         settings = get_settings()
+        block_size = settings.upload_block_size_mb * 1024 * 1024
         blob_service = BlobServiceClient.from_connection_string(
-            settings.abs_string
+            settings.abs_string,
+            max_block_size=block_size,
+            max_single_put_size=block_size,
         )
         self.container_client = blob_service.get_container_client(
             settings.abs_container
         )
+        self.upload_workers = settings.upload_workers
+        self.upload_max_concurrency = settings.upload_max_concurrency
+        self.delete_workers = settings.delete_workers
 
-    def upload_file(self, file_name, file_path):
+    def upload_file(self, file_name, file_path, max_concurrency=1):
         """
-        Upload a blob to Azure Blob Storage
+        Upload a blob to Azure Blob Storage. Files larger than the block size
+        are sent as blocks, max_concurrency of them at a time.
+        The MD5 of the file is stored on the blob; if the blob already exists
+        with the same MD5 the upload is skipped.
         """
+        with metrics.span("upload", path.basename(file_path)) as span:
+            content_md5 = file_digest(file_path, "md5").digest()
+            blob_client = self.container_client.get_blob_client(file_name)
 
-        with open(file_path, "rb") as data:
-            blob_client = self.container_client.upload_blob(
-                file_name, data, overwrite=True
-            )
+            try:
+                properties = blob_client.get_blob_properties()
+                stored_md5 = properties.content_settings.content_md5
+                if stored_md5 and bytes(stored_md5) == content_md5:
+                    logger.info(
+                        f"Blob {file_name} is unchanged, skipping upload"
+                    )
+                    return blob_client.url
+            except ResourceNotFoundError:
+                pass
+
+            with open(file_path, "rb") as data:
+                blob_client.upload_blob(
+                    data,
+                    overwrite=True,
+                    max_concurrency=max_concurrency,
+                    content_settings=ContentSettings(content_md5=content_md5),
+                )
+            span.bytes = path.getsize(file_path)
             return blob_client.url
 
-    def remove_file(self, file_path):
+    def upload_files(self, uploads):
         """
-        Remove a blob from Azure Blob Storage
+        Upload several (file_name, file_path) pairs concurrently.
+        The total number of connections, files in flight times blocks per
+        file, stays within upload_max_concurrency.
+        Return the blob URLs in the order of uploads (None where an upload
+        failed) and a dict with the error of each failed file name.
+        """
+        if not uploads:
+            return [], {}
+
+        files_in_flight = max(min(self.upload_workers, len(uploads)), 1)
+        per_file = max(self.upload_max_concurrency // files_in_flight, 1)
+
+        urls = [None] * len(uploads)
+        failures = {}
+
+        with ThreadPoolExecutor(max_workers=files_in_flight) as executor:
+            futures = {
+                executor.submit(
+                    self.upload_file, file_name, file_path, per_file
+                ): (i, file_name)
+                for i, (file_name, file_path) in enumerate(uploads)
+            }
+            for future in as_completed(futures):
+                i, file_name = futures[future]
+                try:
+                    urls[i] = future.result()
+                    logger.info(f"Uploaded {file_name}")
+                except Exception as e:
+                    logger.error(f"Upload failed for {file_name}: {e}")
+                    failures[file_name] = e
+
+        return urls, failures
+
+    def blob_name(self, file_path):
+        """
+        Get the blob name (path inside the container) of a blob URL or path
         """
         if file_path.startswith("https://"):
             parsed_url = parse.urlparse(file_path)
-            file_path = parsed_url.path.lstrip("/")
+            file_path = parse.unquote(parsed_url.path.lstrip("/"))
 
         container_name = self.container_client.container_name
 
         if file_path.startswith(f"{container_name}/"):
             file_path = file_path[len(f"{container_name}/"):]
 
+        return file_path
+
+    def remove_file(self, file_path):
+        """
+        Remove a blob from Azure Blob Storage
+        """
+        file_path = self.blob_name(file_path)
         blob_client = self.container_client.get_blob_client(file_path)
 
-        if blob_client.exists():
+        try:
             blob_client.delete_blob()
             logger.info(
                 f"Successfully deleted {file_path} from Azure Blob Storage."
             )
-        else:
+        except ResourceNotFoundError:
             logger.warning(
                 f"Blob {file_path} does not exist in Azure Blob Storage."
             )
+
+    def remove_files(self, file_paths, prefix=None):
+        """
+        Remove many blobs with batch delete requests (up to 256 blobs each),
+        sending several batches concurrently. If a prefix is given, every blob
+        under it is removed as well. A blob that does not exist counts as
+        missing, not as an error.
+        Return a summary with the number of deleted and missing blobs and the
+        names of the blobs that could not be deleted.
+        """
+        names = {self.blob_name(file_path) for file_path in file_paths}
+        if prefix:
+            names.update(
+                blob.name
+                for blob in self.container_client.list_blobs(
+                    name_starts_with=prefix
+                )
+            )
+
+        names = sorted(names)
+        batches = [
+            names[start : start + DELETE_BATCH_SIZE]
+            for start in range(0, len(names), DELETE_BATCH_SIZE)
+        ]
+        summary = {"deleted": 0, "missing": 0, "failed": []}
+
+        def delete_batch(batch):
+            try:
+                responses = self.container_client.delete_blobs(
+                    *batch, raise_on_any_failure=False
+                )
+                return list(zip(batch, (r.status_code for r in responses)))
+            except Exception as e:
+                logger.error(f"Batch delete of {len(batch)} blobs failed: {e}")
+                return [(name, None) for name in batch]
+
+        with ThreadPoolExecutor(
+            max_workers=max(self.delete_workers, 1)
+        ) as executor:
+            for results in executor.map(delete_batch, batches):
+                for name, status_code in results:
+                    if status_code in (200, 202):
+                        summary["deleted"] += 1
+                    elif status_code == 404:
+                        summary["missing"] += 1
+                    else:
+                        summary["failed"].append(name)
+
+        logger.info(
+            f"Blobs deleted: {summary['deleted']}, "
+            f"missing: {summary['missing']}, "
+            f"failed: {len(summary['failed'])}"
+        )
+        return summary
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import sys
+from os import makedirs, path
+
+import requests
+
+SCHEMAS_DIR = "spec/schemas"
+SOURCES_FILE = f"{SCHEMAS_DIR}/sources.json"
+
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def vendor_schemas(check_only=False, upstream=False):
+    """
+    Download the schemas listed in SOURCES_FILE that are missing from
+    SCHEMAS_DIR. A schema with a recorded sha256 must match it; the sha256
+    of a schema vendored for the first time is recorded. With check_only,
+    only verify that every schema is vendored and matches its sha256. With
+    upstream, download every schema again and replace the vendored file and
+    its sha256 with the upstream ones.
+    """
+    with open(SOURCES_FILE, "r", encoding="utf-8") as f:
+        sources = json.load(f)
+
+    ok = True
+    for file_name, source in sources.items():
+        file_path = path.join(SCHEMAS_DIR, file_name)
+
+        if path.isfile(file_path) and not upstream:
+            with open(file_path, "rb") as f:
+                content = f.read()
+            if sha256(content) == source["sha256"]:
+                print(f"✅ {file_name}")
+            else:
+                print(f"❌ {file_name}: no coincide con su sha256")
+                ok = False
+            continue
+
+        if check_only:
+            print(f"❌ {file_name}: no se ha descargado")
+            ok = False
+            continue
+
+        response = requests.get(source["url"], timeout=30)
+        response.raise_for_status()
+        content = response.content
+        if upstream:
+            if sha256(content) != source["sha256"]:
+                print(f"⚠ {file_name}: reemplazado por el de {source['url']}")
+            source["origin"] = source["url"]
+            source["sha256"] = sha256(content)
+        elif source["sha256"] is None:
+            source["sha256"] = sha256(content)
+        elif sha256(content) != source["sha256"]:
+            print(f"❌ {source['url']}: no coincide con su sha256")
+            ok = False
+            continue
+
+        makedirs(path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(content)
+        print(f"⬇ {file_name} descargado de {source['url']}")
+
+    if not check_only:
+        with open(SOURCES_FILE, "w", encoding="utf-8") as f:
+            json.dump(sources, f, indent=2)
+            f.write("\n")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    vendor_schemas(
+        check_only="--check" in sys.argv[1:],
+        upstream="--upstream" in sys.argv[1:],
+    )
@@ -0,0 +1,138 @@
+import os
+
+import pytest
+from jsonschema import Draft7Validator
+from referencing import Registry
+
+from utils import stac_validation
+from utils.stac_validation import PROJECTION_SCHEMA, RASTER_SCHEMA
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Layout of the stac-extensions schemas: one branch for items (Feature)
+# and one for collections.
+EXTENSION_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "oneOf": [
+        {
+            "type": "object",
+            "required": ["type", "properties"],
+            "properties": {
+                "type": {"const": "Feature"},
+                "properties": {"$ref": "#/definitions/fields"},
+            },
+        },
+        {
+            "type": "object",
+            "required": ["type"],
+            "properties": {
+                "type": {"const": "Collection"},
+                "summaries": {"$ref": "#/definitions/fields"},
+            },
+        },
+    ],
+    "definitions": {
+        "fields": {
+            "type": "object",
+            "properties": {"proj:epsg": {"type": ["integer", "null"]}},
+        }
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+
+
+def make_item(**properties):
+    return {
+        "type": "Feature",
+        "stac_version": "1.0.0",
+        "stac_extensions": [PROJECTION_SCHEMA, RASTER_SCHEMA],
+        "id": "2020",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]],
+        },
+        "bbox": [0, 0, 1, 1],
+        "properties": {
+            "datetime": "2020-01-01T00:00:00Z",
+            "proj:epsg": 4326,
+            **properties,
+        },
+        "links": [],
+        "assets": {},
+    }
+
+
+def test_extension_error_is_reported_from_the_item_branch():
+    (error,) = Draft7Validator(EXTENSION_SCHEMA).iter_errors(
+        make_item(**{"proj:epsg": "abc"})
+    )
+
+    error = stac_validation.branch_error(error)
+
+    assert list(error.absolute_path) == ["properties", "proj:epsg"]
+    assert error.message == "'abc' is not of type 'integer', 'null'"
+
+
+def test_bundled_extension_error_message():
+    report = stac_validation.validate_objects(
+        [make_item(**{"proj:epsg": "abc"})], stac_validation.ITEM_SCHEMA
+    )
+
+    assert report == {
+        "2020": [
+            "'properties/proj:epsg': 'abc' is not of type 'integer', 'null' "
+            f"(schema {PROJECTION_SCHEMA})"
+        ]
+    }
+
+
+def test_raster_bands_are_validated():
+    item = make_item()
+    item["assets"] = {
+        "input_file": {
+            "href": "2020.tif",
+            "raster:bands": [{"data_type": "bad"}],
+        }
+    }
+
+    report = stac_validation.validate_objects(
+        [item], stac_validation.ITEM_SCHEMA
+    )
+
+    (error,) = report["2020"]
+    assert error.startswith(
+        "'assets/input_file/raster:bands/0/data_type': 'bad' is not one of"
+    )
+    assert error.endswith(f"(schema {RASTER_SCHEMA})")
+
+
+def test_missing_schema_of_a_written_extension_is_an_error(monkeypatch):
+    monkeypatch.setattr(stac_validation, "get_registry", Registry)
+    stac_validation.get_validator.cache_clear()
+
+    try:
+        with pytest.raises(RuntimeError, match="is not bundled"):
+            stac_validation.get_validator(RASTER_SCHEMA)
+        assert stac_validation.get_validator("https://example.com/x") is None
+    finally:
+        stac_validation.get_validator.cache_clear()
+
+
+def test_geometry_error_is_reported_from_its_type_branch():
+    item = make_item()
+    item["geometry"]["coordinates"] = "x"
+
+    report = stac_validation.validate_objects(
+        [item], stac_validation.ITEM_SCHEMA
+    )
+
+    assert report == {
+        "2020": [
+            "'geometry/coordinates': 'x' is not of type 'array' "
+            f"(schema {stac_validation.ITEM_SCHEMA})"
+        ]
+    }
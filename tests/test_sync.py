@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+pytest.importorskip("osgeo")
+
+import main  # noqa: E402
+from utils import stac_rest  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLOB_URL = "https://storage.example/cog-test"
+
+
+class FakeStorage:
+    """
+    Blob storage that keeps the MD5 of each blob and, like Storage, skips
+    the upload of a file whose MD5 matches the blob.
+    """
+
+    def __init__(self):
+        self.blobs = {}
+        self.uploads = []
+
+    def upload_files(self, uploads):
+        urls = []
+        for name, file_path in uploads:
+            with open(file_path, "rb") as f:
+                md5 = hashlib.md5(f.read()).hexdigest()
+            if self.blobs.get(name) != md5:
+                self.blobs[name] = md5
+                self.uploads.append(name)
+            urls.append(f"{BLOB_URL}/{name}")
+        return urls, {}
+
+    def blob_name(self, url):
+        return url.removeprefix(f"{BLOB_URL}/")
+
+    def remove_files(self, urls, prefix=None):
+        for url in urls:
+            self.blobs.pop(self.blob_name(url), None)
+        return {"deleted": len(urls), "missing": 0, "failed": []}
+
+
+class FakeServer:
+    """STAC server that keeps the collections and items posted to it."""
+
+    def __init__(self):
+        self.collections = {}
+        self.items = {}
+
+    def check_resource(self, url):
+        return url.rsplit("/", 1)[-1] in self.collections
+
+    def iter_items(self, url):
+        collection_id = url.split("/")[-2]
+        return iter(list(self.items.get(collection_id, {}).values()))
+
+    def post_or_put(self, url, data):
+        if url.endswith("/collections"):
+            self.collections[data["id"]] = data
+        else:
+            collection_id = url.split("/")[-2]
+            self.items.setdefault(collection_id, {})[data["id"]] = data
+        return SimpleNamespace(status_code=201)
+
+
+def write_layer(file_path, value):
+    data = np.full((64, 64), value, dtype="uint8")
+    with rasterio.open(
+        file_path,
+        "w",
+        driver="GTiff",
+        width=64,
+        height=64,
+        count=1,
+        dtype="uint8",
+        crs="EPSG:4326",
+        transform=from_origin(-74.0, 5.0, 0.01, 0.01),
+    ) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.join(REPO_DIR, "spec"), tmp_path / "spec")
+
+    input_dir = tmp_path / "input" / "layers"
+    input_dir.mkdir(parents=True)
+    write_layer(input_dir / "2020.tif", 1)
+    with open(input_dir / "collection.json", "w") as f:
+        json.dump(
+            {
+                "id": "SyncTest",
+                "title": "Sync test",
+                "description": "Layers published with --sync",
+                "metadata": {
+                    "data_type": "Clasificada",
+                    "projection": {"epsg": 4326},
+                    "properties": {
+                        "values": [0, 1],
+                        "colors": ["#000000", "#ffffff"],
+                        "classes": ["No", "Yes"],
+                    },
+                },
+                "items": [
+                    {
+                        "id": "2020",
+                        "year": "2020",
+                        "assets": {"input_file": "2020.tif"},
+                    }
+                ],
+            },
+            f,
+        )
+
+    server = FakeServer()
+    storage = FakeStorage()
+    for name in ("check_resource", "iter_items", "post_or_put"):
+        monkeypatch.setattr(stac_rest, name, getattr(server, name))
+    monkeypatch.setattr("utils.auth.get_token", lambda: "token")
+    monkeypatch.setattr("utils.storage.Storage", lambda: storage)
+    monkeypatch.setattr(main.get_settings(), "stac_bulk_mode", "off")
+    return input_dir, server, storage
+
+
+def run_sync():
+    args = main.build_parser().parse_args(
+        ["create", "-f", "layers", "-c", "sync-test", "--sync"]
+    )
+    with pytest.raises(SystemExit) as exit_info:
+        main.run_command(args)
+    assert exit_info.value.code == "Process completed successfully."
+
+
+def test_sync_publishes_changed_source(workspace):
+    input_dir, server, storage = workspace
+
+    run_sync()
+    first_md5 = storage.blobs["sync-test/2020.tif"]
+    first_properties = server.items["sync-test"]["2020"]["properties"]
+
+    write_layer(input_dir / "2020.tif", 0)
+    run_sync()
+
+    assert storage.uploads == ["sync-test/2020.tif", "sync-test/2020.tif"]
+    assert storage.blobs["sync-test/2020.tif"] != first_md5
+    assert server.items["sync-test"]["2020"]["properties"] != first_properties